@@ -10,6 +10,7 @@ Usage:
     python main.py --provider ollama --model qwen2.5:0.5b
     python main.py --provider openai --model gpt-4o-mini
     python main.py --provider google --model gemini-2.5-flash
+    python main.py --provider ollama --polling
 
 Environment variables required:
     BOT_TOKEN                    - Telegram bot token from @BotFather
@@ -19,6 +20,10 @@ Environment variables required:
     GOOGLE_API_KEY              - For Google Gemini (if using --provider google)
     OLLAMA_MODEL                 - Default Ollama model (optional, can use --model instead)
     GOOGLE_MODEL                 - Default Google model (optional, can use --model instead)
+    GEMINI_MAX_CONCURRENCY       - Max concurrent Gemini API calls (optional, default: 2)
+    GEMINI_RPM                   - Max Gemini API calls per minute (optional, default: 10)
+    WEBHOOK_URL                  - Public HTTPS base URL for Telegram webhooks (required unless --polling)
+    PORT                         - Local port for the webhook server (optional, default: 8443)
 """
 
 import argparse
@@ -28,8 +33,8 @@ import sys
 from dotenv import load_dotenv
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
 
-from mcp_client import MCPClientFactory, get_default_model
-from telegram_bot import TelegramBot
+from mcp_client import MCPConnectionManager, get_default_model
+from telegram_bot import TelegramBot, BotConfig
 from telegram_bot.daily_todo import daily_todo_reminder
 
 # Load environment variables
@@ -66,6 +71,9 @@ Examples:
   python main.py --provider google --model gemini-2.5-flash
   python main.py --provider google --model gemini-1.5-pro
 
+  # Local development without a public URL (long polling instead of webhooks)
+  python main.py --provider ollama --polling
+
 Default models:
   anthropic: claude-3-5-haiku-20241022
   openai:    gpt-4o-mini
@@ -96,21 +104,29 @@ Default models:
         help='Logging level (default: INFO)'
     )
 
+    parser.add_argument(
+        '--polling',
+        action='store_true',
+        help='Use long polling instead of webhooks (for local development)'
+    )
+
     return parser.parse_args()
 
 
-def validate_environment(provider: str):
+async def validate_environment(config: BotConfig):
     """
     Validate that required environment variables are set.
 
     Args:
-        provider: AI provider name
+        config: Bot configuration
 
     Returns:
         bool: True if all required variables are set, False otherwise
     """
+    provider = config.provider
+
     # BOT_TOKEN is always required
-    if not os.getenv("BOT_TOKEN"):
+    if not config.token:
         logger.error("❌ BOT_TOKEN not found in environment variables!")
         logger.error("   Get a token from @BotFather on Telegram")
         return False
@@ -135,10 +151,10 @@ def validate_environment(provider: str):
             return False
 
     elif provider == "ollama":
-        # Check if Ollama is running
+        # Check if Ollama is running (reusing the bot's pooled Ollama connection)
         try:
-            import httpx
-            response = httpx.get("http://localhost:11434/api/tags", timeout=2)
+            from mcp_client.mcp_client_ollama import get_ollama_http_client
+            response = await get_ollama_http_client().get("/api/tags", timeout=2)
             if response.status_code != 200:
                 logger.warning("⚠️  Ollama API returned unexpected status")
         except Exception:
@@ -162,17 +178,23 @@ async def initialize_mcp(provider: str, model: str):
     """
     Initialize MCP client.
 
+    The client is wrapped in a connection manager that reconnects it
+    automatically if the MCP server dies while the bot is running.
+
     Args:
         provider: AI provider name
         model: Model name
 
     Returns:
-        MCP client instance or None
+        MCPConnectionManager instance or None
     """
     # Build list of connections to enable
     connections = ['notion', 'google_calendar']
 
-    return await MCPClientFactory.initialize_mcp_client(provider, model, connections)
+    manager = MCPConnectionManager(provider, model, connections)
+    if not await manager.connect():
+        return None
+    return manager
 
 
 async def main_async(args):
@@ -180,41 +202,45 @@ async def main_async(args):
     # Set logging level
     logging.getLogger().setLevel(args.log_level)
 
-    # Get model (use argument or default)
-    model = args.model or get_default_model(args.provider)
+    # Resolve configuration once from arguments and environment
+    config = BotConfig(
+        token=os.getenv("BOT_TOKEN"),
+        provider=args.provider,
+        model=args.model or get_default_model(args.provider),
+        webhook_url=None if args.polling else os.getenv("WEBHOOK_URL"),
+        port=int(os.getenv("PORT", "8443"))
+    )
 
     logger.info("=" * 60)
     logger.info("🤖 Jarvis - AI Telegram Bot")
     logger.info("=" * 60)
-    logger.info(f"Provider: {args.provider}")
-    logger.info(f"Model:    {model}")
+    logger.info(f"Provider: {config.provider}")
+    logger.info(f"Model:    {config.model}")
+    logger.info(f"Updates:  {'webhook' if config.webhook_url else 'polling'}")
 
     logger.info("=" * 60)
 
     # Validate environment
-    if not validate_environment(args.provider):
+    if not await validate_environment(config):
         logger.error("\n❌ Environment validation failed!")
         logger.error("   Please check your .env file and ensure all required variables are set.")
         sys.exit(1)
 
+    # Webhooks by default, polling only when explicitly requested
+    if not args.polling and not config.webhook_url:
+        logger.warning("⚠️  WEBHOOK_URL not set - falling back to long polling")
+        logger.warning("   Set WEBHOOK_URL or pass --polling to silence this warning")
+
     # Initialize MCP client
-    mcp_client = await initialize_mcp(args.provider, model)
+    mcp_client = await initialize_mcp(config.provider, config.model)
 
     if not mcp_client:
         logger.error("❌ Failed to initialize MCP client!")
         logger.error("   The bot will start but AI features will not work.")
         logger.error("   Check the logs above for details.")
 
-    # Get bot token
-    bot_token = os.getenv("BOT_TOKEN")
-
     # Create Telegram bot
-    bot = TelegramBot(
-        token=bot_token,
-        mcp_client=mcp_client,
-        provider_name=args.provider,
-        model_name=model
-    )
+    bot = TelegramBot(config, mcp_client=mcp_client)
 
     # Initialize the bot to create the application instance
     await bot.initialize()
@@ -237,7 +263,17 @@ async def main_async(args):
     logger.info("✅ Starting Telegram bot...\n")
 
     # Run the bot
-    await bot.run()
+    try:
+        await bot.run()
+    finally:
+        if mcp_client:
+            await mcp_client.close()
+        if config.provider == "ollama":
+            from mcp_client.mcp_client_ollama import close_ollama_http_clients
+            await close_ollama_http_clients()
+        elif config.provider == "anthropic":
+            from mcp_client.mcp_client import close_anthropic_client
+            await close_anthropic_client()
 
 
 def main():
@@ -247,9 +283,18 @@ def main():
     # Parse arguments
     args = parse_arguments()
 
+    # Use uvloop's faster event loop when it is installed (not available on Windows)
+    run = asyncio.run
+    if sys.platform != "win32":
+        try:
+            import uvloop
+            run = uvloop.run
+        except ImportError:
+            pass
+
     # Run async main
     try:
-        asyncio.run(main_async(args))
+        run(main_async(args))
     except KeyboardInterrupt:
         logger.info("\n\n👋 Bot stopped by user")
         sys.exit(0)
@@ -6,17 +6,35 @@ Provides multiple AI provider options:
 - MCPClientOpenAI: OpenAI GPT models
 - MCPClientOllama: Free local models via Ollama
 - MCPClientFactory: Factory for creating clients based on provider
+- MCPConnectionManager: Keeps a client connected, reconnecting on failure
+
+Provider clients are imported lazily, so only the selected provider's SDK is loaded.
 """
 
-from .mcp_client import MCPClient
-from .mcp_client_openai import MCPClientOpenAI
-from .mcp_client_ollama import MCPClientOllama
+import importlib
+
 from .factory import MCPClientFactory, get_default_model
+from .connection_manager import MCPConnectionManager
+
+# Lazily imported provider clients (PEP 562): attribute name -> submodule
+_LAZY_CLIENTS = {
+    "MCPClient": ".mcp_client",
+    "MCPClientOpenAI": ".mcp_client_openai",
+    "MCPClientOllama": ".mcp_client_ollama",
+}
 
 __all__ = [
     "MCPClient",
     "MCPClientOpenAI",
     "MCPClientOllama",
     "MCPClientFactory",
+    "MCPConnectionManager",
     "get_default_model"
 ]
+
+
+def __getattr__(name):
+    if name in _LAZY_CLIENTS:
+        module = importlib.import_module(_LAZY_CLIENTS[name], __name__)
+        return getattr(module, name)
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
@@ -0,0 +1,190 @@
+"""
+MCP Connection Manager
+
+Keeps a long-lived MCP client connected, health-checking the session
+before use and reconnecting with exponential backoff when it has died
+(e.g. the npx server subprocess crashed). While idle, the session is
+pinged periodically so a dead one is replaced before the next query.
+
+Each client is opened and closed by its own background task. The MCP
+transports run anyio task groups that must be exited by the task that
+entered them, which a handler task triggering a reconnect can't guarantee.
+"""
+
+import asyncio
+import logging
+from typing import Optional, List
+
+from .factory import MCPClientFactory
+
+logger = logging.getLogger(__name__)
+
+
+class MCPConnectionManager:
+    """Owns an MCP client and transparently reconnects it when the session drops."""
+
+    def __init__(
+        self,
+        provider: str,
+        model: Optional[str] = None,
+        connections: Optional[List[str]] = None,
+        max_retries: int = 3,
+        backoff_base: float = 1.0,
+        health_check_timeout: float = 5.0,
+        keepalive_interval: float = 30.0
+    ):
+        """
+        Initialize the connection manager.
+
+        Args:
+            provider: AI provider name
+            model: Model name (optional)
+            connections: List of connection names to enable (see MCPClientFactory)
+            max_retries: Number of reconnect attempts before giving up
+            backoff_base: Initial backoff delay in seconds (doubled after each attempt)
+            health_check_timeout: Seconds to wait for a ping before treating the session as dead
+            keepalive_interval: Seconds between background pings of the session (0 to disable)
+        """
+        self.provider = provider
+        self.model = model
+        self.connections = connections
+        self.max_retries = max_retries
+        self.backoff_base = backoff_base
+        self.health_check_timeout = health_check_timeout
+        self.keepalive_interval = keepalive_interval
+        self.client = None
+        self._lock = asyncio.Lock()
+        self._owner_task: Optional[asyncio.Task] = None
+        self._stop: Optional[asyncio.Event] = None
+        self._keepalive_task: Optional[asyncio.Task] = None
+
+    @property
+    def session(self):
+        """MCP session of the current client, or None if not connected."""
+        return self.client.session if self.client else None
+
+    async def connect(self) -> bool:
+        """
+        Connect (or reconnect) the MCP client, retrying with exponential backoff.
+
+        Returns:
+            bool: True if a client is connected, False otherwise
+        """
+        await self._close_client()
+
+        for attempt in range(self.max_retries):
+            self.client = await self._start_client()
+            if self.client:
+                if self.keepalive_interval and not self._keepalive_task:
+                    self._keepalive_task = asyncio.create_task(self._keepalive())
+                return True
+
+            if attempt < self.max_retries - 1:
+                delay = self.backoff_base * 2 ** attempt
+                logger.warning(f"MCP connection attempt {attempt + 1} failed, retrying in {delay:.0f}s...")
+                await asyncio.sleep(delay)
+
+        logger.error(f"❌ Could not connect MCP client after {self.max_retries} attempts")
+        return False
+
+    async def close(self):
+        """Close the MCP client and its connections."""
+        async with self._lock:
+            # Holding the lock, so the keepalive task is sleeping or waiting for it
+            if self._keepalive_task:
+                self._keepalive_task.cancel()
+                self._keepalive_task = None
+            await self._close_client()
+
+    async def get_client(self):
+        """
+        Get a healthy MCP client, reconnecting if the session has died.
+
+        Returns:
+            Connected MCP client instance
+
+        Raises:
+            ConnectionError: If the client cannot be (re)connected
+        """
+        async with self._lock:
+            if not await self._is_healthy():
+                logger.warning("🔄 MCP session unavailable, reconnecting...")
+                if not await self.connect():
+                    raise ConnectionError("MCP client not connected")
+            return self.client
+
+    async def process_query(self, query: str, *args, **kwargs) -> str:
+        """Process a query on a healthy client (same signature as the client's process_query)."""
+        client = await self.get_client()
+        return await client.process_query(query, *args, **kwargs)
+
+    async def stream_query(self, query: str, *args, **kwargs):
+        """Stream a query's response from a healthy client.
+
+        Falls back to yielding the complete response at once for clients
+        without streaming support.
+        """
+        client = await self.get_client()
+        if hasattr(client, "stream_query"):
+            async for chunk in client.stream_query(query, *args, **kwargs):
+                yield chunk
+        else:
+            yield await client.process_query(query, *args, **kwargs)
+
+    async def _is_healthy(self) -> bool:
+        """Ping the MCP server to check that the session is still alive."""
+        if not self.session:
+            return False
+        try:
+            await asyncio.wait_for(self.session.send_ping(), timeout=self.health_check_timeout)
+            return True
+        except Exception as e:
+            logger.warning(f"MCP health check failed: {e}")
+            return False
+
+    async def _keepalive(self):
+        """Ping the session while idle, reconnecting in the background if it has died."""
+        while True:
+            await asyncio.sleep(self.keepalive_interval)
+            async with self._lock:
+                if not await self._is_healthy():
+                    logger.warning("🔄 MCP session lost while idle, reconnecting...")
+                    await self.connect()
+
+    async def _start_client(self):
+        """Start an owner task for a new client and wait until it has connected (or failed)."""
+        ready = asyncio.get_running_loop().create_future()
+        stop = asyncio.Event()
+        task = asyncio.create_task(self._own_client(ready, stop))
+
+        client = await ready
+        if client:
+            self._owner_task, self._stop = task, stop
+        else:
+            await task
+        return client
+
+    async def _own_client(self, ready: asyncio.Future, stop: asyncio.Event):
+        """Open a client, hand it over through `ready`, and close it once `stop` is set."""
+        client = await MCPClientFactory.initialize_mcp_client(
+            self.provider, self.model, self.connections
+        )
+        if not client:
+            ready.set_result(None)
+            return
+
+        async with client:
+            ready.set_result(client)
+            await stop.wait()
+
+    async def _close_client(self):
+        """Release the current client's resources, ignoring errors from a dead session."""
+        if not self.client:
+            return
+        self._stop.set()
+        try:
+            await self._owner_task
+        except Exception as e:
+            logger.debug(f"Error while closing MCP client: {e}")
+        self.client = None
+        self._owner_task = self._stop = None
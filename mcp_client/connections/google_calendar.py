@@ -5,12 +5,41 @@ Uses OAuth 2.0 authentication via nspady/google-calendar-mcp.
 The OAuth flow happens once - user authenticates via browser, then tokens are stored locally.
 """
 
+import json
 import os
 import logging
+from functools import lru_cache
+
+from .npx import server_command, server_env
 
 logger = logging.getLogger(__name__)
 
 
+@lru_cache(maxsize=32)
+def _verify_creds(path: str, mtime: float) -> None:
+    """Check that the file is an OAuth client credentials file.
+
+    Cached by path and modification time, so the file is only read again after it changes.
+    """
+    try:
+        with open(path) as f:
+            creds = json.load(f)
+    except (OSError, ValueError) as e:
+        raise ValueError(f"Could not read OAuth credentials file {path}: {e}")
+
+    if not isinstance(creds, dict) or not ("installed" in creds or "web" in creds):
+        raise ValueError(f"Not an OAuth client credentials file (expected an 'installed' or 'web' client): {path}")
+
+
+def _token_path() -> str:
+    """Where the calendar server stores its OAuth tokens (GOOGLE_CALENDAR_MCP_TOKEN_PATH or its default)."""
+    token_path = os.getenv("GOOGLE_CALENDAR_MCP_TOKEN_PATH")
+    if token_path:
+        return token_path
+    config_dir = os.getenv("APPDATA") if os.name == "nt" else os.path.expanduser("~/.config")
+    return os.path.join(config_dir, "google-calendar-mcp", "tokens.json")
+
+
 async def connect_google_calendar(client, env: dict = None):
     """
     Connect to Google Calendar MCP server using OAuth 2.0.
@@ -22,6 +51,9 @@ async def connect_google_calendar(client, env: dict = None):
 
     After initial setup, tokens are reused automatically.
 
+    If GOOGLE_CALENDAR_MCP_URL is set, connects over HTTP to a server that is
+    already running (in HTTP mode) instead of launching one over stdio.
+
     Args:
         client: MCP client instance
         env: Optional environment variables to pass to the server
@@ -32,6 +64,18 @@ async def connect_google_calendar(client, env: dict = None):
     Raises:
         ValueError: If GOOGLE_OAUTH_CREDENTIALS is not set
     """
+    server_url = os.getenv("GOOGLE_CALENDAR_MCP_URL")
+    if server_url:
+        # The running server holds its own OAuth credentials
+        try:
+            logger.info(f"🔌 Connecting to Google Calendar MCP server at {server_url}...")
+            await client.connect_to_server(transport="streamable_http", url=server_url)
+            logger.info("✅ Connected to Google Calendar MCP server!")
+            return True
+        except Exception as e:
+            logger.error(f"Failed to connect to Google Calendar: {e}")
+            raise
+
     google_oauth_creds = os.getenv("GOOGLE_OAUTH_CREDENTIALS")
     if not google_oauth_creds:
         raise ValueError(
@@ -39,23 +83,38 @@ async def connect_google_calendar(client, env: dict = None):
             "See docs/GOOGLE_CALENDAR_SETUP.md for setup instructions."
         )
 
-    # Verify file exists
-    if not os.path.exists(google_oauth_creds):
+    # Verify the file exists and holds OAuth client credentials
+    try:
+        mtime = os.path.getmtime(google_oauth_creds)
+    except OSError:
         raise ValueError(f"OAuth credentials file not found: {google_oauth_creds}")
+    _verify_creds(google_oauth_creds, mtime)
 
     try:
         logger.info("🔌 Connecting to Google Calendar MCP server...")
-        logger.info("📝 First-time setup will open a browser for authentication")
 
-        # Create environment with OAuth credentials
-        env_vars = env or os.environ.copy()
-        env_vars["GOOGLE_OAUTH_CREDENTIALS"] = google_oauth_creds
+        # The server reuses (and refreshes) stored tokens, so the browser
+        # flow is only needed when none have been stored yet
+        token_path = _token_path()
+        if os.path.exists(token_path):
+            logger.info(f"🔑 Reusing stored OAuth tokens from {token_path}")
+        else:
+            logger.info("📝 First-time setup will open a browser for authentication")
+
+        # The OAuth settings plus the proxy/display variables that are set (the
+        # first-run browser flow needs DISPLAY/BROWSER); the MCP SDK adds PATH, HOME, ...
+        env_vars = server_env(
+            env,
+            GOOGLE_OAUTH_CREDENTIALS=google_oauth_creds,
+            GOOGLE_CALENDAR_MCP_TOKEN_PATH=token_path
+        )
 
         # Connect to Google Calendar MCP server (nspady/google-calendar-mcp)
-        # This uses npx to run the npm package
+        # This uses the installed binary if available, otherwise npx runs the npm package
+        command, args = server_command("@cocal/google-calendar-mcp", "google-calendar-mcp")
         await client.connect_to_server(
-            command="npx",
-            args=["-y", "@cocal/google-calendar-mcp"],
+            command=command,
+            args=args,
             env=env_vars
         )
 
@@ -5,6 +5,8 @@ Notion MCP Server Connection
 import os
 import logging
 
+from .npx import server_command, server_env
+
 logger = logging.getLogger(__name__)
 
 
@@ -29,14 +31,15 @@ async def connect_notion(client, env: dict = None):
     try:
         logger.info("🔌 Connecting to Notion MCP server...")
 
-        # Create environment with Notion token
-        env_vars = env or os.environ.copy()
-        env_vars["NOTION_TOKEN"] = notion_token
+        # The Notion token plus the proxy/display variables that are set; the MCP
+        # SDK adds its default environment (PATH, HOME, ...)
+        env_vars = server_env(env, NOTION_TOKEN=notion_token)
 
-        # Connect to Notion MCP server
+        # Connect to Notion MCP server (installed binary if available, else npx)
+        command, args = server_command("@notionhq/notion-mcp-server", "notion-mcp-server")
         await client.connect_to_server(
-            command="npx",
-            args=["-y", "@notionhq/notion-mcp-server"],
+            command=command,
+            args=args,
             env=env_vars
         )
 
@@ -0,0 +1,58 @@
+"""
+Command and environment resolution for Node-based MCP servers
+"""
+
+import os
+import shutil
+from functools import lru_cache
+from typing import List, Tuple
+
+# Binaries of packages installed into the project (`npm install <package>` in the repo root)
+_PROJECT_DIR = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+LOCAL_BIN_DIR = os.path.join(_PROJECT_DIR, "node_modules", ".bin")
+
+# Variables passed on to server subprocesses when set, on top of the MCP SDK's
+# defaults (HOME, PATH, USER, ...): the display/browser for first-run OAuth
+# (e.g. over `ssh -X`) and the proxy / CA settings of proxied networks
+PASSTHROUGH_ENV_VARS = (
+    "DISPLAY", "WAYLAND_DISPLAY", "BROWSER",
+    "HTTP_PROXY", "HTTPS_PROXY", "NO_PROXY", "http_proxy", "https_proxy", "no_proxy",
+    "NODE_EXTRA_CA_CERTS", "SSL_CERT_FILE",
+)
+
+
+@lru_cache(maxsize=None)
+def server_command(package: str, binary: str) -> Tuple[str, List[str]]:
+    """
+    Get the command used to launch a Node MCP server.
+
+    Prefers an installed binary - in the project's node_modules (`npm install <package>`)
+    or on PATH (`npm install -g <package>`) - which starts straight away, over
+    `npx -y`, which resolves the package on every launch.
+
+    Args:
+        package: npm package name (e.g. "@notionhq/notion-mcp-server")
+        binary: Executable the package installs (e.g. "notion-mcp-server")
+
+    Returns:
+        (command, args) to pass to connect_to_server
+    """
+    installed = shutil.which(binary, path=LOCAL_BIN_DIR) or shutil.which(binary)
+    if installed:
+        return installed, []
+    return "npx", ["-y", package]
+
+
+def server_env(env: dict = None, **variables) -> dict:
+    """
+    Build the environment for a Node MCP server subprocess.
+
+    Args:
+        env: Optional extra environment variables
+        **variables: Server settings (e.g. NOTION_TOKEN), which take precedence
+
+    Returns:
+        The PASSTHROUGH_ENV_VARS that are set, plus env and variables
+    """
+    passthrough = {name: os.environ[name] for name in PASSTHROUGH_ENV_VARS if name in os.environ}
+    return {**passthrough, **(env or {}), **variables}
@@ -8,14 +8,15 @@ import os
 import logging
 from typing import Optional, List
 
-from .mcp_client import MCPClient
-from .mcp_client_openai import MCPClientOpenAI
-from .mcp_client_ollama import MCPClientOllama
-from .mcp_client_google import MCPClientGoogle
 from .connections import connect_notion
 
 logger = logging.getLogger(__name__)
 
+# Connection name -> (display name, connect function)
+CONNECTORS = {
+    'notion': ('Notion', connect_notion),
+}
+
 
 class MCPClientFactory:
     """Factory for creating MCP clients based on provider."""
@@ -37,16 +38,17 @@ class MCPClientFactory:
         """
         provider = provider.lower()
 
+        # Provider clients are imported on demand so only the selected SDK is loaded
         if provider == "anthropic":
-            # Anthropic/Claude - model is set in the client's process_query
+            # Anthropic/Claude
             # Default models: claude-3-5-haiku-20241022, claude-sonnet-4-20250514, claude-opus-4-20250514
-            if model:
-                logger.info(f"Note: Model '{model}' will be used in process_query")
-            return MCPClient()
+            from .mcp_client import MCPClient
+            return MCPClient(model=model) if model else MCPClient()
 
         elif provider == "openai":
             # OpenAI - model is passed to process_query
             # Default models: gpt-4o, gpt-4o-mini
+            from .mcp_client_openai import MCPClientOpenAI
             return MCPClientOpenAI()
 
         elif provider == "ollama":
@@ -54,7 +56,8 @@ class MCPClientFactory:
             # Default: qwen2.5:0.5b
             # Common models: qwen2.5:0.5b, qwen2.5:1.5b, llama3.2:1b, llama3.2:3b
             model = model or os.getenv("OLLAMA_MODEL", "qwen2.5:0.5b")
-            return MCPClientOllama(model=model)
+            from .mcp_client_ollama import MCPClientOllama, DEFAULT_KEEP_ALIVE
+            return MCPClientOllama(model=model, keep_alive=os.getenv("OLLAMA_KEEP_ALIVE", DEFAULT_KEEP_ALIVE))
 
         elif provider == "google" or provider == "gemini":
             # Google Gemini - cloud-based models
@@ -64,6 +67,7 @@ class MCPClientFactory:
             if not api_key:
                 raise ValueError("GOOGLE_API_KEY environment variable not set")
             model = model or os.getenv("GOOGLE_MODEL", "gemini-2.5-flash")
+            from .mcp_client_google import MCPClientGoogle
             return MCPClientGoogle(model=model, api_key=api_key)
 
         else:
@@ -100,20 +104,16 @@ class MCPClientFactory:
             # Create client
             client = MCPClientFactory.create_client(provider, model)
 
-            # Connect to each requested MCP server
+            # Connect to each requested MCP server. This is deliberately sequential:
+            # stdio_client runs an anyio task group that must be exited by the task
+            # that entered it, so connections can't be entered from gathered tasks
+            # and later closed by the client's owner.
             connected_services = []
 
             for connection in connections:
-                try:
-                    if connection == 'notion':
-                        await connect_notion(client)
-                        connected_services.append('Notion')
-                    else:
-                        logger.warning(f"Unknown connection type: {connection}")
-                except ValueError as e:
-                    logger.warning(f"Skipping {connection}: {e}")
-                except Exception as e:
-                    logger.error(f"Failed to connect to {connection}: {e}")
+                service = await MCPClientFactory._connect(client, connection)
+                if service:
+                    connected_services.append(service)
 
             if not connected_services:
                 logger.warning("No MCP services connected. AI features will be limited.")
@@ -127,6 +127,28 @@ class MCPClientFactory:
             logger.warning("AI features will be limited without MCP.")
             return None
 
+    @staticmethod
+    async def _connect(client, connection: str) -> Optional[str]:
+        """
+        Connect a client to a single MCP server, logging any failure.
+
+        Returns:
+            Display name of the connected service, or None if it was skipped or failed
+        """
+        if connection not in CONNECTORS:
+            logger.warning(f"Unknown connection type: {connection}")
+            return None
+
+        service, connect = CONNECTORS[connection]
+        try:
+            await connect(client)
+            return service
+        except ValueError as e:
+            logger.warning(f"Skipping {connection}: {e}")
+        except Exception as e:
+            logger.error(f"Failed to connect to {connection}: {e}")
+        return None
+
 
 def get_default_model(provider: str) -> str:
     """
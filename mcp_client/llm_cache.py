@@ -0,0 +1,29 @@
+"""
+LLM Response Cache
+
+Short-lived in-memory cache of model responses, keyed by everything that
+determines a response (model, system prompt, messages and tools), so a
+repeated agent turn skips the round-trip to the model.
+"""
+
+import hashlib
+
+from cachetools import TTLCache
+
+from .tool_utils import canonical_json
+
+LLM_CACHE_TTL = 300  # seconds
+LLM_CACHE_SIZE = 256
+
+# Shared by all clients - the model is part of the key
+llm_cache = TTLCache(maxsize=LLM_CACHE_SIZE, ttl=LLM_CACHE_TTL)
+
+
+def llm_cache_key(**parts) -> str:
+    """Build a cache key from the parts of a model request."""
+    return hashlib.blake2b(canonical_json(parts), digest_size=16).hexdigest()
+
+
+def tools_hash(tools) -> str:
+    """Hash a list of MCP tools, so the tool schemas don't need to be part of every key."""
+    return llm_cache_key(tools=[(tool.name, tool.description, tool.inputSchema) for tool in tools])
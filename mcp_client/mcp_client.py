@@ -1,26 +1,120 @@
 
 import asyncio
+import io
 import logging
 from typing import Optional
-from contextlib import AsyncExitStack
+from contextlib import AsyncExitStack, aclosing
 
-from mcp import ClientSession, StdioServerParameters
-from mcp.client.stdio import stdio_client
+from mcp import ClientSession
+from mcp.types import CallToolResult, TextContent
 
-from anthropic import Anthropic
+from .tool_utils import QueryReport, ToolCallCache
+from .transport import open_transport
+
+import httpx
+from anthropic import AsyncAnthropic, DefaultAsyncHttpxClient
+from jiter import from_json
 from dotenv import load_dotenv
 
-load_dotenv()  # load environment variables from .env
+
+# Static system prompt - kept identical across calls so it can be served from Anthropic's prompt cache
+SYSTEM_PROMPT = """You are an AI assistant with access to the user's Notion workspace via MCP tools.
+
+When the user asks a question:
+1. Use the appropriate tool to get the needed information
+2. Answer their question based on the tool results
+3. Be clear and concise in your response"""
+
+# Optional sentinel tool Claude can call to finish, so the agent loop can stop without
+# another round-trip to confirm there are no more tool calls (a plain text reply also ends it)
+FINAL_ANSWER_TOOL = {
+    "name": "return_final_answer",
+    "description": "Return the final answer to the user's question and end the turn. Optional - replying with plain text also ends the turn.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "text": {"type": "string", "description": "The complete answer shown to the user"}
+        },
+        "required": ["text"]
+    }
+}
+
+# Tool results from earlier turns larger than this are replaced by a placeholder
+# in the conversation history, so they aren't re-sent to Claude on every turn
+RESULT_OMIT_THRESHOLD = 4096  # characters
+
+# Synthetic tool Claude can call to get an omitted result back
+CACHED_RESULT_TOOL = {
+    "name": "get_cached_result",
+    "description": "Retrieve the full content of an earlier tool result that was omitted from the conversation.",
+    "input_schema": {
+        "type": "object",
+        "properties": {
+            "id": {"type": "string", "description": "The id given in the omitted result's placeholder"}
+        },
+        "required": ["id"]
+    }
+}
+
+# Safety cap on the size of a complete response (streamed or not)
+MAX_OUTPUT_CHARS = 20000
+
+# Cache breakpoint on the static system prompt
+SYSTEM_BLOCKS = [{
+    "type": "text",
+    "text": SYSTEM_PROMPT,
+    "cache_control": {"type": "ephemeral"}
+}]
+
+# Models: claude-3-5-haiku-20241022 (cheapest/fastest)
+#         claude-sonnet-4-20250514 (balanced)
+#         claude-opus-4-20250514 (most capable)
+DEFAULT_MODEL = "claude-3-5-haiku-20241022"  # Using Haiku - 90% cheaper!
+
+# One pooled keep-alive Anthropic client, shared by all MCPClient instances
+_anthropic_client: Optional[AsyncAnthropic] = None
+
+
+def get_anthropic_client() -> AsyncAnthropic:
+    """Get the shared Anthropic client, creating it on first use."""
+    global _anthropic_client
+    if _anthropic_client is None or _anthropic_client.is_closed():
+        _anthropic_client = AsyncAnthropic(
+            http_client=DefaultAsyncHttpxClient(
+                limits=httpx.Limits(max_connections=100, max_keepalive_connections=20, keepalive_expiry=30.0)
+            )
+        )
+    return _anthropic_client
+
+
+async def close_anthropic_client():
+    """Close the shared Anthropic client (call once on shutdown)."""
+    global _anthropic_client
+    if _anthropic_client is not None:
+        await _anthropic_client.close()
+        _anthropic_client = None
 
 class MCPClient:
-    def __init__(self):
+    def __init__(self, model: str = DEFAULT_MODEL):
         # Initialize session and client objects
+        self.model = model
         self.session: Optional[ClientSession] = None
         self.exit_stack = AsyncExitStack()
-        self.anthropic = Anthropic()
+        self.anthropic = get_anthropic_client()
+        self._tool_calls = ToolCallCache()
+        self._available_tools: Optional[list] = None
     # methods will go here
 
-    async def connect_to_server(self, server_script_path: str = None, env: dict = None, command: str = None, args: list = None):
+    async def __aenter__(self):
+        await self.exit_stack.__aenter__()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        """Close the MCP connections in the task that opened them."""
+        return await self.exit_stack.__aexit__(*exc_info)
+
+    async def connect_to_server(self, server_script_path: str = None, env: dict = None, command: str = None, args: list = None,
+                                transport: str = "stdio", url: str = None, headers: dict = None):
         """Connect to an MCP server
 
         Args:
@@ -28,58 +122,140 @@ class MCPClient:
             env: Optional environment variables to pass to the server
             command: Direct command to run (e.g., "npx", "python")
             args: Arguments for the command (e.g., ["@notionhq/notion-mcp-server"])
+            transport: "stdio" (launch the server as a subprocess), "sse" or "streamable_http"
+            url: Server endpoint for the HTTP transports
+            headers: Optional HTTP headers for the HTTP transports
         """
-        # New direct method: command + args
-        if command and args:
-            server_params = StdioServerParameters(
-                command=command,
-                args=args,
-                env=env
-            )
-        # Legacy method: script path
-        elif server_script_path:
-            is_python = server_script_path.endswith('.py')
-            is_js = server_script_path.endswith('.js')
-            if not (is_python or is_js):
-                raise ValueError("Server script must be a .py or .js file")
-
-            cmd = "python" if is_python else "node"
-            server_params = StdioServerParameters(
-                command=cmd,
-                args=[server_script_path],
-                env=env
-            )
-        else:
-            raise ValueError("Must provide either (command + args) or server_script_path")
+        # Connect on a local exit stack so a failed connect shuts the server down
+        # straight away; on success ownership moves to the client's exit stack
+        async with AsyncExitStack() as connection_stack:
+            stdio, write = await connection_stack.enter_async_context(open_transport(
+                transport, server_script_path, env, command, args, url=url, headers=headers
+            ))
+            session = await connection_stack.enter_async_context(ClientSession(stdio, write))
+
+            await session.initialize()
+
+            # List available tools once - the tool list rarely changes during a session
+            response = await session.list_tools()
+            self.exit_stack.push_async_callback(connection_stack.pop_all().aclose)
+
+        self.stdio, self.write, self.session = stdio, write, session
+        self._set_tools(response.tools)
+        print("\nConnected to server with tools:", [tool["name"] for tool in self._available_tools])
+
+    def _set_tools(self, mcp_tools):
+        """Build the tool schemas sent to Claude from the MCP tool list."""
+        available_tools = [{
+            "name": tool.name,
+            "description": tool.description,
+            "input_schema": tool.inputSchema
+        } for tool in mcp_tools]
+        available_tools.append(dict(CACHED_RESULT_TOOL))
+        available_tools.append(dict(FINAL_ANSWER_TOOL))
 
-        stdio_transport = await self.exit_stack.enter_async_context(stdio_client(server_params))
-        self.stdio, self.write = stdio_transport
-        self.session = await self.exit_stack.enter_async_context(ClientSession(self.stdio, self.write))
+        # Cache breakpoint on the last tool caches the whole tool schema block
+        # (tools are the first part of the prompt prefix)
+        if available_tools:
+            available_tools[-1]["cache_control"] = {"type": "ephemeral"}
 
-        await self.session.initialize()
+        self._available_tools = available_tools
 
-        # List available tools
+    async def refresh_tools(self):
+        """Fetch the tool list again (for the rare case the server's tools change)."""
         response = await self.session.list_tools()
-        tools = response.tools
-        print("\nConnected to server with tools:", [tool.name for tool in tools])
+        self._set_tools(response.tools)
+
+    @staticmethod
+    def _omit_old_results(messages: list, omitted_results: dict):
+        """Replace large tool results in all but the latest message with a placeholder.
 
-    async def process_query(self, query: str, max_iterations: int = 10) -> str:
+        The original contents are kept in omitted_results (by tool_use_id) so
+        Claude can retrieve them with the get_cached_result tool.
+        """
+        for message in messages[:-1]:
+            if message["role"] != "user" or not isinstance(message["content"], list):
+                continue
+            for block in message["content"]:
+                if block.get("type") != "tool_result" or block["tool_use_id"] in omitted_results:
+                    continue
+                if len(str(block["content"])) > RESULT_OMIT_THRESHOLD:
+                    omitted_results[block["tool_use_id"]] = block["content"]
+                    block["content"] = (
+                        f"[result omitted; id={block['tool_use_id']} - "
+                        f"call {CACHED_RESULT_TOOL['name']} to retrieve]"
+                    )
+
+    @staticmethod
+    async def _get_omitted_result(omitted_results: dict, result_id: str) -> CallToolResult:
+        """Serve a get_cached_result call from the omitted results."""
+        if result_id not in omitted_results:
+            return CallToolResult(content=[TextContent(type="text", text=f"No omitted result with id {result_id}")], isError=True)
+        return CallToolResult(content=omitted_results[result_id])
+
+    async def process_query(self, query: str, max_iterations: int = 10, max_output_chars: int = MAX_OUTPUT_CHARS,
+                            report: Optional[QueryReport] = None) -> str:
         """Process a query using Claude and available tools with agent loop logic
 
         Args:
             query: The user's question
             max_iterations: Maximum number of agent loop iterations (default: 10)
+            max_output_chars: Truncate the response (and stop the agent loop) beyond this length
+            report: Optional QueryReport to fill in with the tools called
 
         Returns:
             Combined response with intermediate tool calls and final answer
         """
-        # Get MCP tools
-        response = await self.session.list_tools()
-        available_tools = [{
-            "name": tool.name,
-            "description": tool.description,
-            "input_schema": tool.inputSchema
-        } for tool in response.tools]
+        final_text = io.StringIO()
+        async for chunk in self.stream_query(query, max_iterations, max_output_chars, report):
+            final_text.write(chunk)
+
+        return final_text.getvalue().rstrip()
+
+    async def stream_query(self, query: str, max_iterations: int = 10, max_output_chars: int = MAX_OUTPUT_CHARS,
+                           report: Optional[QueryReport] = None):
+        """Process a query like process_query, yielding the response as it is generated
+
+        Tool calls are started as soon as their block has been streamed, so
+        they run while Claude is still generating the rest of the response.
+
+        Args:
+            query: The user's question
+            max_iterations: Maximum number of agent loop iterations (default: 10)
+            max_output_chars: Truncate the response (and stop the agent loop) beyond this length
+            report: Optional QueryReport to fill in with the tools called
+
+        Yields:
+            Response text chunks (model tokens, tool call notes and separators)
+        """
+        if report is None:
+            report = QueryReport()
+
+        length = 0
+        async with aclosing(self._run_agent_loop(query, max_iterations, report)) as chunks:
+            async for chunk in chunks:
+                if length + len(chunk) > max_output_chars:
+                    logging.warning(f"Response exceeded {max_output_chars} characters, truncating")
+                    report.complete = False
+                    yield chunk[:max_output_chars - length]
+                    yield "\n\n[Response truncated]"
+                    return
+                length += len(chunk)
+                yield chunk
+
+    async def _run_agent_loop(self, query: str, max_iterations: int, report: QueryReport):
+        """Run the agent loop for stream_query, yielding response chunks without a size cap."""
+        # Get MCP tools (cached since connect)
+        if self._available_tools is None:
+            await self.refresh_tools()
+
+        # Everything but the messages is the same on every turn
+        request_template = {
+            "model": self.model,
+            "max_tokens": 1000,
+            "system": SYSTEM_BLOCKS,
+            "tools": self._available_tools,
+        }
 
         messages = [
             {
@@ -88,8 +264,11 @@ class MCPClient:
             }
         ]
 
-        # Track intermediate text responses
-        final_text = []
+        # Large tool results omitted from the history, by tool_use_id
+        omitted_results = {}
+
+        # Separator emitted before the next response segment (text or tool call note)
+        separator = ""
 
         # Agent loop: continue until no more tool calls or max iterations reached
         iteration = 0
@@ -97,119 +276,156 @@ class MCPClient:
             iteration += 1
             logging.info(f"Agent loop iteration {iteration}/{max_iterations}")
 
-            # Call Claude API
-            # Models: claude-3-5-haiku-20241022 (cheapest/fastest)
-            #         claude-sonnet-4-20250514 (balanced)
-            #         claude-opus-4-20250514 (most capable)
-            response = self.anthropic.messages.create(
-                model="claude-3-5-haiku-20241022",  # Using Haiku - 90% cheaper!
-                max_tokens=1000,
-                messages=messages,
-                tools=available_tools,
-            )
-
-            logging.info(f"Claude response: {response}")
-
-            # Collect assistant message content (text + tool uses)
-            assistant_message_content = []
-            has_tool_calls = False
-
-            # Process response content
-            for content in response.content:
-                assistant_message_content.append(content)
-
-                if content.type == 'text':
-                    # Preserve text content
-                    if content.text:
-                        final_text.append(content.text)
-
-                elif content.type == 'tool_use':
-                    has_tool_calls = True
-                    tool_name = content.name
-                    tool_args = content.input
-
-                    logging.info(f"Calling tool: {tool_name}")
-                    logging.info(f"Tool args: {tool_args}")
-
-                    # Execute tool call via MCP
-                    mcp_result = await self.session.call_tool(tool_name, tool_args)
-
-                    # Add note about tool call to final text
-                    final_text.append(f"[Calling tool: {tool_name}]")
-                    logging.info(f"Tool result: {mcp_result.content}")
-
-            # Check if there are tool calls to process
-            if not has_tool_calls:
-                # No more tool calls - agent is done
-                logging.info("No tool calls found. Agent loop complete.")
-                break
+            tool_uses = []
+            tool_tasks = []
+            final_answer = False
+            try:
+                # Call Claude API, streaming the response as it is generated
+                async with self.anthropic.messages.stream(messages=messages, **request_template) as stream:
+                    block_has_text = False
+                    in_final_answer = False
+                    answer_json = ""
+                    answer_length = 0
+                    async for event in stream:
+                        if event.type == "content_block_start":
+                            block_has_text = False
+                            in_final_answer = (
+                                event.content_block.type == "tool_use"
+                                and event.content_block.name == FINAL_ANSWER_TOOL["name"]
+                            )
+                            answer_json = ""
+                            answer_length = 0
+
+                        elif event.type == "input_json" and in_final_answer:
+                            # Stream the answer as its arguments are generated (the SDK's own
+                            # snapshot leaves out a string until it is complete)
+                            answer_json += event.partial_json
+                            try:
+                                answer = from_json(answer_json.encode(), partial_mode="trailing-strings")
+                            except ValueError:
+                                continue
+                            text = (answer.get("text") or "") if isinstance(answer, dict) else ""
+                            if len(text) > answer_length:
+                                yield text[answer_length:] if answer_length else separator + text
+                                answer_length = len(text)
+
+                        elif event.type == "text":
+                            # Preserve text content
+                            yield event.text if block_has_text else separator + event.text
+                            block_has_text = True
+
+                        elif event.type == "content_block_stop":
+                            if event.content_block.type == "text" and block_has_text:
+                                separator = "\n\n"
+
+                            elif event.content_block.type == "tool_use" and event.content_block.name == FINAL_ANSWER_TOOL["name"]:
+                                final_answer = True
+                                text = event.content_block.input.get("text") or ""
+                                if len(text) > answer_length:
+                                    yield text[answer_length:] if answer_length else separator + text
+                                if text:
+                                    separator = "\n\n"
+
+                            elif event.content_block.type == "tool_use" and event.content_block.name == CACHED_RESULT_TOOL["name"]:
+                                content = event.content_block
+                                logging.info(f"Retrieving omitted result: {content.input.get('id')}")
+                                tool_uses.append(content)
+                                tool_tasks.append(asyncio.create_task(
+                                    self._get_omitted_result(omitted_results, content.input.get("id"))
+                                ))
+
+                            elif event.content_block.type == "tool_use":
+                                content = event.content_block
+                                logging.info(f"Calling tool: {content.name}")
+                                logging.debug("Tool args: %s", content.input)
+
+                                # Execute tool call via MCP while the rest of the response streams in
+                                report.tools_called.append(content.name)
+                                tool_uses.append(content)
+                                tool_tasks.append(asyncio.create_task(
+                                    self._tool_calls.call_tool(self.session, content.name, content.input)
+                                ))
+
+                                # Add note about tool call to the response
+                                yield f"{separator}[Calling tool: {content.name}]"
+                                separator = "\n\n"
+
+                    response = await stream.get_final_message()
+
+                logging.debug("Claude response: %s", response)
+
+                # Tool calls are independent within a single response, so together
+                # they take max(latency) rather than sum
+                mcp_results = await asyncio.gather(*tool_tasks)
+
+                if final_answer:
+                    # Claude has answered - skip the confirmation round-trip
+                    logging.info("Final answer returned. Agent loop complete.")
+                    break
+
+                # Check if there are tool calls to process
+                if not tool_uses:
+                    # No more tool calls - agent is done
+                    logging.info("No tool calls found. Agent loop complete.")
+                    break
+            except BaseException:
+                for task in tool_tasks:
+                    task.cancel()
+                raise
 
             # Add the assistant's message with tool calls to history
             messages.append({
                 "role": "assistant",
-                "content": assistant_message_content
+                "content": response.content
             })
 
             # Add tool results to messages
             tool_results = []
-            for content in assistant_message_content:
-                if content.type == 'tool_use':
-                    # Re-execute tool to get result (already executed above for logging)
-                    mcp_result = await self.session.call_tool(content.name, content.input)
-                    tool_results.append({
-                        "type": "tool_result",
-                        "tool_use_id": content.id,
-                        "content": mcp_result.content
-                    })
+            for content, mcp_result in zip(tool_uses, mcp_results):
+                logging.debug("Tool result: %s", mcp_result.content)
+                tool_results.append({
+                    "type": "tool_result",
+                    "tool_use_id": content.id,
+                    "content": mcp_result.content
+                })
 
             messages.append({
                 "role": "user",
                 "content": tool_results
             })
+            self._omit_old_results(messages, omitted_results)
 
             # Continue loop - agent will process tool results and decide next action
 
         if iteration >= max_iterations:
             logging.warning(f"Agent loop reached max iterations ({max_iterations})")
-            final_text.append(f"[Warning: Reached maximum iteration limit of {max_iterations}]")
-
-        return "\n\n".join(final_text)
+            report.complete = False
+            yield f"{separator}[Warning: Reached maximum iteration limit of {max_iterations}]"
 
 async def main():
     """Example main function for standalone usage."""
     import os
-
-    client = MCPClient()
+    from .connections import connect_notion
 
     # Connect to Notion
-    notion_token = os.getenv("NOTION_INTEGRATION_TOKEN")
-    if not notion_token:
+    if not os.getenv("NOTION_INTEGRATION_TOKEN"):
         print("Set NOTION_INTEGRATION_TOKEN in .env first!")
         return
 
-    env_vars = os.environ.copy()
-    env_vars["NOTION_API_KEY"] = notion_token
-
-    try:
-        await client.connect_to_server(
-            command="npx",
-            args=["-y", "@notionhq/notion-mcp-server"],
-            env=env_vars
-        )
+    async with MCPClient() as client:
+        await connect_notion(client)
 
         # Interactive query loop
         print("\n✅ Connected! Ask me anything (or 'quit' to exit):\n")
         while True:
-            query = input("You: ")
+            query = await asyncio.to_thread(input, "You: ")
             if query.lower() in ['quit', 'exit', 'q']:
                 break
 
             response = await client.process_query(query)
             print(f"\nAI: {response}\n")
 
-    finally:
-        await client.exit_stack.aclose()
-
 
 if __name__ == "__main__":
+    load_dotenv()  # load environment variables from .env
     asyncio.run(main())
\ No newline at end of file
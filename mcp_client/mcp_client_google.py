@@ -14,20 +14,56 @@ Setup:
 """
 
 import asyncio
-import json
 import logging
 import os
 from typing import Optional
 from contextlib import AsyncExitStack
 
-from mcp import ClientSession, StdioServerParameters
-from mcp.client.stdio import stdio_client
+from aiolimiter import AsyncLimiter
+from mcp import ClientSession
+
+from .llm_cache import llm_cache, llm_cache_key, tools_hash
+from .tool_utils import LoopDetector, QueryReport, ToolCallCache, clean_tool_args, is_mutating_tool, truncate_tool_result
+from .transport import open_transport
 
 from google import genai
-from google.genai import types
-from dotenv import load_dotenv
+from google.genai import errors, types
+
+# Simplified system prompt for Gemini, filled in with the tool list once per session
+SYSTEM_PROMPT_TEMPLATE = """You are an AI assistant with access to Notion tools via MCP.
+
+Available tools:
+{tool_descriptions}
+
+When the user asks a question:
+1. Use the appropriate tool to get the needed information
+2. Answer their question based on the tool results
+3. Be clear and concise in your response"""
+
+# User-facing replies for Gemini API errors, by HTTP status code
+API_ERROR_MESSAGES = {
+    429: "Error: Rate limit exceeded. Please try again later.",
+    401: "Error: Invalid API key.",
+    400: "Error: Invalid request to API.",
+}
+
+# Retries of a rate-limited (429) call, with exponential backoff from RATE_LIMIT_BACKOFF seconds
+RATE_LIMIT_RETRIES = 3
+RATE_LIMIT_BACKOFF = 2.0
+
+# Shared across clients so concurrent queries stay under the API's limits
+# (created on first use, after .env has been loaded)
+_gemini_semaphore: Optional[asyncio.Semaphore] = None
+_gemini_rate_limiter: Optional[AsyncLimiter] = None
+
 
-load_dotenv()
+def _get_gemini_limits():
+    """Get the concurrency semaphore and requests-per-minute limiter for Gemini API calls."""
+    global _gemini_semaphore, _gemini_rate_limiter
+    if _gemini_semaphore is None:
+        _gemini_semaphore = asyncio.Semaphore(int(os.getenv("GEMINI_MAX_CONCURRENCY", "2")))
+        _gemini_rate_limiter = AsyncLimiter(int(os.getenv("GEMINI_RPM", "10")), 60)
+    return _gemini_semaphore, _gemini_rate_limiter
 
 
 class MCPClientGoogle:
@@ -50,136 +86,129 @@ class MCPClientGoogle:
 
         self.session: Optional[ClientSession] = None
         self.exit_stack = AsyncExitStack()
+        self._tool_calls = ToolCallCache()
 
-    @staticmethod
-    def _clean_tool_args(args: dict) -> dict:
-        """Remove empty strings, empty objects, and None values from tool arguments.
+        # Tool list and everything derived from it, built once per session
+        self._mcp_tools: Optional[list] = None
+        self._tools_hash: Optional[str] = None
+        self._system_instruction: Optional[str] = None
+        self._generate_config: Optional[types.GenerateContentConfig] = None
 
-        This is necessary because models may include optional parameters
-        with empty values, which causes API validation errors.
-        """
-        cleaned = {}
-        for key, value in args.items():
-            # Skip None values
-            if value is None:
-                continue
-            # Skip empty strings
-            if isinstance(value, str) and value == "":
-                continue
-            # Skip empty dicts
-            if isinstance(value, dict) and not value:
-                continue
-            # Skip empty lists
-            if isinstance(value, list) and not value:
-                continue
-            # Recursively clean nested dicts
-            if isinstance(value, dict):
-                cleaned_nested = MCPClientGoogle._clean_tool_args(value)
-                if cleaned_nested:  # Only include if not empty after cleaning
-                    cleaned[key] = cleaned_nested
-            else:
-                cleaned[key] = value
-        return cleaned
+    async def __aenter__(self):
+        await self.exit_stack.__aenter__()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        """Close the MCP connections in the task that opened them."""
+        return await self.exit_stack.__aexit__(*exc_info)
 
     @staticmethod
-    def _convert_mcp_tools_to_google_format(mcp_tools) -> list:
+    def _automatic_tool_calls(response) -> list:
+        """Get the names of the MCP tools the SDK called itself while generating (automatic function calling)."""
+        return [
+            part.function_call.name
+            for content in response.automatic_function_calling_history or []
+            for part in content.parts or []
+            if part.function_call
+        ]
+
+    @classmethod
+    def _is_cacheable(cls, response) -> bool:
+        """Check whether a response can be reused without skipping side effects.
+
+        A response produced by calling a mutating tool must not be reused.
         """
-        Convert MCP tools to Google Gemini Tool format using SDK types.
+        if any(is_mutating_tool(name) for name in cls._automatic_tool_calls(response)):
+            return False
+        return bool(response.candidates)
 
-        Args:
-            mcp_tools: List of MCP tool objects with name, description, inputSchema
-
-        Returns:
-            List of genai.types.Tool objects
-        """
-        if not mcp_tools:
-            return []
-
-        # Convert to Google's Tool format
-        function_declarations = []
-        for tool in mcp_tools:
-            func_decl = types.FunctionDeclaration(
-                name=tool.name,
-                description=tool.description or "No description provided",
-                parameters=tool.inputSchema
-            )
-            function_declarations.append(func_decl)
-
-        return [types.Tool(function_declarations=function_declarations)]
-
-    async def connect_to_server(self, server_script_path: str = None, env: dict = None, command: str = None, args: list = None):
+    async def connect_to_server(self, server_script_path: str = None, env: dict = None, command: str = None, args: list = None,
+                                transport: str = "stdio", url: str = None, headers: dict = None):
         """Connect to an MCP server"""
-        if command and args:
-            server_params = StdioServerParameters(
-                command=command,
-                args=args,
-                env=env
-            )
-        elif server_script_path:
-            is_python = server_script_path.endswith('.py')
-            is_js = server_script_path.endswith('.js')
-            if not (is_python or is_js):
-                raise ValueError("Server script must be a .py or .js file")
-
-            cmd = "python" if is_python else "node"
-            server_params = StdioServerParameters(
-                command=cmd,
-                args=[server_script_path],
-                env=env
-            )
-        else:
-            raise ValueError("Must provide either (command + args) or server_script_path")
-
-        stdio_transport = await self.exit_stack.enter_async_context(stdio_client(server_params))
-        self.stdio, self.write = stdio_transport
-        self.session = await self.exit_stack.enter_async_context(ClientSession(self.stdio, self.write))
-
-        await self.session.initialize()
+        # Connect on a local exit stack so a failed connect shuts the server down
+        # straight away; on success ownership moves to the client's exit stack
+        async with AsyncExitStack() as connection_stack:
+            stdio, write = await connection_stack.enter_async_context(open_transport(
+                transport, server_script_path, env, command, args, url=url, headers=headers
+            ))
+            session = await connection_stack.enter_async_context(ClientSession(stdio, write))
+
+            await session.initialize()
+
+            response = await session.list_tools()
+            self.exit_stack.push_async_callback(connection_stack.pop_all().aclose)
+
+        self.stdio, self.write, self.session = stdio, write, session
+        self._set_tools(response.tools)
+        print("\nConnected to server with tools:", [tool.name for tool in self._mcp_tools])
+
+    def _set_tools(self, mcp_tools):
+        """Store the MCP tool list and build the system instruction and request config from it."""
+        self._mcp_tools = mcp_tools
+        self._tools_hash = tools_hash(mcp_tools)
+
+        # Build tool descriptions for system instruction
+        tool_descriptions = "\n".join(f"- {tool.name}: {tool.description}" for tool in mcp_tools)
 
+        self._system_instruction = SYSTEM_PROMPT_TEMPLATE.format(tool_descriptions=tool_descriptions)
+
+        self._generate_config = types.GenerateContentConfig(
+            system_instruction=self._system_instruction,
+            tools=[self.session],
+            temperature=0.7,
+            max_output_tokens=2048
+        )
+
+    async def refresh_tools(self):
+        """Fetch the tool list again (for the rare case the server's tools change)."""
         response = await self.session.list_tools()
-        tools = response.tools
-        print("\nConnected to server with tools:", [tool.name for tool in tools])
+        self._set_tools(response.tools)
 
-    async def process_query(self, query: str, max_iterations: int = 10) -> str:
+    async def _generate_content(self, contents):
+        """Call Gemini with the session's tools, backing off and retrying when rate limited."""
+        semaphore, rate_limiter = _get_gemini_limits()
+        for attempt in range(RATE_LIMIT_RETRIES + 1):
+            try:
+                # Throttle up front rather than relying on retries after a 429.
+                # The async client keeps the event loop and the MCP session's
+                # stdio reader running during the API call.
+                async with semaphore, rate_limiter:
+                    return await self.client.aio.models.generate_content(
+                        model=self.model,
+                        contents=contents,
+                        config=self._generate_config
+                    )
+            except errors.APIError as e:
+                if e.code != 429 or attempt == RATE_LIMIT_RETRIES:
+                    raise
+                delay = RATE_LIMIT_BACKOFF * 2 ** attempt
+                logging.warning(f"Gemini rate limit hit, retrying in {delay:.0f}s...")
+                await asyncio.sleep(delay)
+
+    async def process_query(self, query: str, max_iterations: int = 10, report: Optional[QueryReport] = None) -> str:
         """Process a query using Google Gemini SDK and available tools with agent loop logic
 
         Args:
             query: The user's question
             max_iterations: Maximum number of agent loop iterations (default: 10)
+            report: Optional QueryReport to fill in with the tools called
 
         Returns:
             Combined response with intermediate tool calls and final answer
         """
-        # Get MCP tools and convert to Google format
-        await self.session.initialize()
-        response = await self.session.list_tools()
-        mcp_tools = response.tools
-
-        google_tools = self._convert_mcp_tools_to_google_format(mcp_tools)
-
-        # Build tool descriptions for system instruction
-        tool_descriptions = "\n".join([
-            f"- {tool.name}: {tool.description}"
-            for tool in mcp_tools
-        ])
-
-        # Simplified system prompt for Gemini
-        system_instruction = f"""You are an AI assistant with access to Notion tools via MCP.
+        if report is None:
+            report = QueryReport()
 
-Available tools:
-{tool_descriptions}
-
-When the user asks a question:
-1. Use the appropriate tool to get the needed information
-2. Answer their question based on the tool results
-3. Be clear and concise in your response"""
-
-        # Initialize conversation history
-        history = []
+        # MCP tools, system instruction and request config (built once per session)
+        if self._mcp_tools is None:
+            await self.refresh_tools()
+        system_instruction = self._system_instruction
 
         # Track intermediate text responses
         final_text = []
 
+        loop_detector = LoopDetector()
+
         # Agent loop: continue until no more tool calls or max iterations reached
         iteration = 0
         user_message = query
@@ -192,30 +221,36 @@ When the user asks a question:
                 # Call Gemini API using SDK
                 logging.info(f"Calling Gemini API with model: {self.model}")
 
-                # Generate content with tools
-                response = self.client.models.generate_content(
-                    model=self.model,
-                    contents=user_message,
-                    config=types.GenerateContentConfig(
-                        system_instruction=system_instruction,
-                        tools=[self.session],
-                        temperature=0.7,
-                        max_output_tokens=2048
-                    )
+                # Reuse the response to an identical request
+                cache_key = llm_cache_key(
+                    model=self.model, contents=user_message, system=system_instruction, tools=self._tools_hash
                 )
+                response = llm_cache.get(cache_key)
+                if response is not None:
+                    logging.info("LLM cache hit")
+                else:
+                    response = await self._generate_content(user_message)
+                    if self._is_cacheable(response):
+                        llm_cache[cache_key] = response
 
-                logging.info(f"Response received: {response}")
+                logging.debug("Response received: %s", response)
 
                 # Check if response has function calls
                 if not response.candidates:
                     logging.error("No candidates in response")
                     break
 
+                # Note tools the SDK already called, like the ones called below
+                for tool_name in self._automatic_tool_calls(response):
+                    report.tools_called.append(tool_name)
+                    final_text.append(f"[Calling tool: {tool_name}]")
+
                 candidate = response.candidates[0]
 
                 # Check for safety blocks
                 if hasattr(candidate, 'finish_reason') and candidate.finish_reason:
                     if 'SAFETY' in str(candidate.finish_reason):
+                        report.complete = False
                         return "Response blocked by safety filters. Please rephrase your query."
 
                 # Extract content parts
@@ -242,33 +277,51 @@ When the user asks a question:
                     logging.info("No function calls found. Agent loop complete.")
                     break
 
-                # Add assistant's response to history
-                history.append({"role": "model", "parts": [{"function_call": fc} for fc in function_calls_in_iteration]})
-
-                # Process each function call
-                function_responses = []
+                # Clean tool arguments
+                calls = []
                 for function_call in function_calls_in_iteration:
                     tool_name = function_call.name
                     tool_args = dict(function_call.args) if hasattr(function_call, 'args') else {}
 
-                    # Clean tool arguments
-                    cleaned_args = self._clean_tool_args(tool_args)
                     logging.info(f"Calling tool: {tool_name}")
-                    logging.info(f"Original args: {tool_args}")
-                    logging.info(f"Cleaned args: {cleaned_args}")
-
-                    # Execute tool via MCP
-                    mcp_result = await self.session.call_tool(tool_name, cleaned_args)
+                    logging.debug("Original args: %s", tool_args)
+                    cleaned_args = clean_tool_args(tool_args)
+                    logging.debug("Cleaned args: %s", cleaned_args)
+                    calls.append((tool_name, cleaned_args))
+
+                # Stop early rather than spending the remaining iterations on a repeating call
+                for tool_name, tool_args in calls:
+                    if loop_detector.record(tool_name, tool_args):
+                        logging.warning(f"Tool call loop detected: {tool_name}")
+                        report.complete = False
+                        final_text.append(f"[Loop detected: {tool_name} keeps being called with the same arguments; aborting]")
+                        return "\n\n".join(final_text)
+
+                # Execute the tool calls via MCP concurrently (identical reads are made once) -
+                # a failed call is reported to the model so it can recover
+                report.tools_called.extend(tool_name for tool_name, _ in calls)
+                mcp_results = await asyncio.gather(
+                    *[self._tool_calls.call_tool(self.session, tool_name, tool_args) for tool_name, tool_args in calls],
+                    return_exceptions=True
+                )
 
+                function_responses = []
+                for (tool_name, _), mcp_result in zip(calls, mcp_results):
                     # Add note about tool call to final text
                     final_text.append(f"[Calling tool: {tool_name}]")
-                    logging.info(f"Tool result: {mcp_result.content}")
+
+                    if isinstance(mcp_result, BaseException):
+                        logging.warning(f"Tool {tool_name} failed: {mcp_result}")
+                        result_content = f"Error: {mcp_result}"
+                    else:
+                        logging.debug("Tool result: %s", mcp_result.content)
+                        result_content = truncate_tool_result(str(mcp_result.content))
 
                     # Build function response for next iteration
                     function_responses.append(
                         types.Part.from_function_response(
                             name=tool_name,
-                            response={"content": str(mcp_result.content)}
+                            response={"content": result_content}
                         )
                     )
 
@@ -277,21 +330,17 @@ When the user asks a question:
                     role="user",
                     parts=function_responses
                 )
-                history.append({"role": "user", "parts": function_responses})
 
             except Exception as e:
-                logging.error(f"Error in Gemini API call: {e}", exc_info=True)
-                if "429" in str(e) or "rate limit" in str(e).lower():
-                    return "Error: Rate limit exceeded. Please try again later."
-                elif "401" in str(e) or "unauthorized" in str(e).lower():
-                    return "Error: Invalid API key."
-                elif "400" in str(e):
-                    logging.error(f"Bad request error. Iteration {iteration}")
-                    return f"Error: Invalid request to API."
+                logging.error(f"Error in Gemini API call (iteration {iteration}): {e}", exc_info=True)
+                if isinstance(e, errors.APIError) and e.code in API_ERROR_MESSAGES:
+                    report.complete = False
+                    return API_ERROR_MESSAGES[e.code]
                 raise
 
         if iteration >= max_iterations:
             logging.warning(f"Agent loop reached max iterations ({max_iterations})")
+            report.complete = False
             final_text.append(f"[Warning: Reached maximum iteration limit of {max_iterations}]")
 
         return "\n\n".join(final_text)
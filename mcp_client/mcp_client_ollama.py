@@ -16,119 +16,22 @@ Installation:
 """
 
 import asyncio
-import json
 import logging
 from typing import Optional
-from contextlib import AsyncExitStack
+from contextlib import AsyncExitStack, aclosing
 
-from mcp import ClientSession, StdioServerParameters
-from mcp.client.stdio import stdio_client
+from mcp import ClientSession
 
-import httpx
-from dotenv import load_dotenv
-
-load_dotenv()
-
-
-class MCPClientOllama:
-    def __init__(self, model: str = "llama3.2:latest", base_url: str = "http://localhost:11434"):
-        self.model = model
-        self.session: Optional[ClientSession] = None
-        self.exit_stack = AsyncExitStack()
-        self.base_url = base_url
-        self.client = httpx.AsyncClient(timeout=30.0)
-
-    @staticmethod
-    def _clean_tool_args(args: dict) -> dict:
-        """Remove empty strings, empty objects, and None values from tool arguments.
-
-        This is necessary because small Ollama models often include optional parameters
-        with empty values, which causes API validation errors.
-        """
-        cleaned = {}
-        for key, value in args.items():
-            # Skip None values
-            if value is None:
-                continue
-            # Skip empty strings
-            if isinstance(value, str) and value == "":
-                continue
-            # Skip empty dicts
-            if isinstance(value, dict) and not value:
-                continue
-            # Skip empty lists
-            if isinstance(value, list) and not value:
-                continue
-            # Recursively clean nested dicts
-            if isinstance(value, dict):
-                cleaned_nested = MCPClientOllama._clean_tool_args(value)
-                if cleaned_nested:  # Only include if not empty after cleaning
-                    cleaned[key] = cleaned_nested
-            else:
-                cleaned[key] = value
-        return cleaned
-
-    async def connect_to_server(self, server_script_path: str = None, env: dict = None, command: str = None, args: list = None):
-        """Connect to an MCP server"""
-        if command and args:
-            server_params = StdioServerParameters(
-                command=command,
-                args=args,
-                env=env
-            )
-        elif server_script_path:
-            is_python = server_script_path.endswith('.py')
-            is_js = server_script_path.endswith('.js')
-            if not (is_python or is_js):
-                raise ValueError("Server script must be a .py or .js file")
-
-            cmd = "python" if is_python else "node"
-            server_params = StdioServerParameters(
-                command=cmd,
-                args=[server_script_path],
-                env=env
-            )
-        else:
-            raise ValueError("Must provide either (command + args) or server_script_path")
-
-        stdio_transport = await self.exit_stack.enter_async_context(stdio_client(server_params))
-        self.stdio, self.write = stdio_transport
-        self.session = await self.exit_stack.enter_async_context(ClientSession(self.stdio, self.write))
-
-        await self.session.initialize()
-
-        response = await self.session.list_tools()
-        tools = response.tools
-        print("\nConnected to server with tools:", [tool.name for tool in tools])
-
-    async def process_query(self, query: str, max_iterations: int = 10) -> str:
-        """Process a query using Ollama and available tools with agent loop logic
-
-        Args:
-            query: The user's question
-            max_iterations: Maximum number of agent loop iterations (default: 10)
+from .llm_cache import llm_cache, llm_cache_key, tools_hash
+from .tool_utils import LoopDetector, QueryReport, ToolCallCache, clean_tool_args, truncate_tool_result
+from .transport import open_transport
 
-        Returns:
-            Combined response with intermediate tool calls and final answer
-        """
-        # Get MCP tools and convert to Ollama format
-        response = await self.session.list_tools()
-        available_tools = [{
-            "type": "function",
-            "function": {
-                "name": tool.name,
-                "description": tool.description,
-                "parameters": tool.inputSchema
-            }
-        } for tool in response.tools]
+import httpx
+import orjson
 
-        # Build system message explaining agent role and available tools
-        tool_descriptions = "\n".join([
-            f"- {tool['function']['name']}: {tool['function']['description']}"
-            for tool in available_tools
-        ])
 
-        system_message = f"""You are an AI assistant with access to tools via MCP (Model Context Protocol).
+# System message explaining the agent role, filled in with the tool list once per session
+SYSTEM_PROMPT_TEMPLATE = """You are an AI assistant with access to tools via MCP (Model Context Protocol).
 
 Your role:
 - You are an agent that can use tools to answer questions
@@ -167,6 +70,141 @@ Examples:
 - To search Notion: Use API-post-search with only the query parameter (omit start_cursor, page_size if not needed)
 - To list pages: Use API-post-search with an empty or simple query"""
 
+DEFAULT_BASE_URL = "http://localhost:11434"
+
+# How long Ollama keeps the model loaded after a request. Its default (5m) means
+# the first query after a quiet spell pays for reloading the model from disk.
+DEFAULT_KEEP_ALIVE = "30m"
+
+# One pooled keep-alive HTTP client per Ollama server, shared by all MCPClientOllama instances
+_http_clients = {}
+
+
+def get_ollama_http_client(base_url: str = DEFAULT_BASE_URL) -> httpx.AsyncClient:
+    """Get the shared HTTP client for an Ollama server, creating it on first use."""
+    client = _http_clients.get(base_url)
+    if client is None or client.is_closed:
+        client = httpx.AsyncClient(
+            base_url=base_url,
+            timeout=httpx.Timeout(30.0, connect=5.0),
+            # Limits go on the transport - a custom transport ignores the client's limits.
+            # Retries only cover failed connects (e.g. Ollama restarting), never a sent request.
+            transport=httpx.AsyncHTTPTransport(
+                retries=2,
+                limits=httpx.Limits(max_keepalive_connections=32, max_connections=64, keepalive_expiry=60.0)
+            )
+        )
+        _http_clients[base_url] = client
+    return client
+
+
+async def close_ollama_http_clients():
+    """Close all shared Ollama HTTP clients (call once on shutdown)."""
+    for client in _http_clients.values():
+        await client.aclose()
+    _http_clients.clear()
+
+
+class MCPClientOllama:
+    def __init__(self, model: str = "llama3.2:latest", base_url: str = DEFAULT_BASE_URL, keep_alive: str = DEFAULT_KEEP_ALIVE):
+        self.model = model
+        self.keep_alive = keep_alive
+        self.session: Optional[ClientSession] = None
+        self.exit_stack = AsyncExitStack()
+        self.base_url = base_url
+        self.client = get_ollama_http_client(base_url)
+        self._tool_calls = ToolCallCache()
+
+        # Tool list and everything derived from it, built once per session
+        self._available_tools: Optional[list] = None
+        self._tools_hash: Optional[str] = None
+        self._system_message: Optional[str] = None
+
+    async def __aenter__(self):
+        await self.exit_stack.__aenter__()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        """Close the MCP connections in the task that opened them."""
+        return await self.exit_stack.__aexit__(*exc_info)
+
+    async def connect_to_server(self, server_script_path: str = None, env: dict = None, command: str = None, args: list = None,
+                                transport: str = "stdio", url: str = None, headers: dict = None):
+        """Connect to an MCP server"""
+        # Connect on a local exit stack so a failed connect shuts the server down
+        # straight away; on success ownership moves to the client's exit stack
+        async with AsyncExitStack() as connection_stack:
+            stdio, write = await connection_stack.enter_async_context(open_transport(
+                transport, server_script_path, env, command, args, url=url, headers=headers
+            ))
+            session = await connection_stack.enter_async_context(ClientSession(stdio, write))
+
+            await session.initialize()
+
+            response = await session.list_tools()
+            self.exit_stack.push_async_callback(connection_stack.pop_all().aclose)
+
+        self.stdio, self.write, self.session = stdio, write, session
+        self._set_tools(response.tools)
+        print("\nConnected to server with tools:", [tool["function"]["name"] for tool in self._available_tools])
+
+    def _set_tools(self, mcp_tools):
+        """Build the Ollama tool format and system message from the MCP tool list."""
+        self._tools_hash = tools_hash(mcp_tools)
+
+        # Convert MCP tools to Ollama format
+        self._available_tools = [{
+            "type": "function",
+            "function": {
+                "name": tool.name,
+                "description": tool.description,
+                "parameters": tool.inputSchema
+            }
+        } for tool in mcp_tools]
+
+        # Build system message explaining agent role and available tools
+        tool_descriptions = "\n".join(f"- {tool.name}: {tool.description}" for tool in mcp_tools)
+
+        self._system_message = SYSTEM_PROMPT_TEMPLATE.format(tool_descriptions=tool_descriptions)
+
+    async def refresh_tools(self):
+        """Fetch the tool list again (for the rare case the server's tools change)."""
+        response = await self.session.list_tools()
+        self._set_tools(response.tools)
+
+    async def process_query(self, query: str, max_iterations: int = 10, report: Optional[QueryReport] = None) -> str:
+        """Process a query using Ollama and available tools with agent loop logic
+
+        Args:
+            query: The user's question
+            max_iterations: Maximum number of agent loop iterations (default: 10)
+            report: Optional QueryReport to fill in with the tools called
+
+        Returns:
+            Combined response with intermediate tool calls and final answer
+        """
+        return "".join([chunk async for chunk in self.stream_query(query, max_iterations, report)])
+
+    async def stream_query(self, query: str, max_iterations: int = 10, report: Optional[QueryReport] = None):
+        """Process a query like process_query, yielding the response as it is generated
+
+        Args:
+            query: The user's question
+            max_iterations: Maximum number of agent loop iterations (default: 10)
+            report: Optional QueryReport to fill in with the tools called
+
+        Yields:
+            Response text chunks (model tokens, tool call notes and separators)
+        """
+        if report is None:
+            report = QueryReport()
+
+        # MCP tools in Ollama format and system message (built once per session)
+        if self._available_tools is None:
+            await self.refresh_tools()
+        available_tools = self._available_tools
+        system_message = self._system_message
+
         messages = [
             {
                 "role": "system",
@@ -178,8 +216,10 @@ Examples:
             }
         ]
 
-        # Track intermediate text responses
-        final_text = []
+        # Separator emitted before the next response segment (text or tool call note)
+        separator = ""
+
+        loop_detector = LoopDetector()
 
         # Agent loop: continue until no more tool calls or max iterations reached
         iteration = 0
@@ -187,29 +227,86 @@ Examples:
             iteration += 1
             logging.info(f"Agent loop iteration {iteration}/{max_iterations}")
 
-            # Call Ollama API
             payload = {
                 "model": self.model,
                 "messages": messages,
                 "tools": available_tools,
-                "stream": False
+                "stream": True,
+                "keep_alive": self.keep_alive
             }
-
-            response = await self.client.post(
-                f"{self.base_url}/api/chat",
-                json=payload
-            )
-
-            result = response.json()
-            message = result["message"]
-            logging.info(f"Agent response: {message}")
-
-            # Preserve any text content from this iteration
-            if message.get("content"):
-                final_text.append(message["content"])
+            # The system message is part of messages
+            cache_key = llm_cache_key(model=self.model, messages=messages, tools=self._tools_hash)
+
+            content = ""
+            in_text = False
+            tool_calls = []
+            tool_names = []
+            tool_tasks = []
+            looping_tool = None
+            try:
+                # Call Ollama API, streaming tokens as they are generated
+                async with aclosing(self._chat(payload, cache_key)) as deltas:
+                    async for token, new_tool_calls in deltas:
+                        if token:
+                            yield token if in_text else separator + token
+                            in_text = True
+                            separator = "\n\n"
+                            content += token
+
+                        for tool_call in new_tool_calls:
+                            tool_calls.append(tool_call)
+                            function = tool_call["function"]
+                            tool_name = function["name"]
+                            logging.info(f"Calling tool: {tool_name}")
+
+                            # Clean tool arguments to remove empty values that cause API errors
+                            logging.debug("Original args: %s", function["arguments"])
+                            cleaned_args = clean_tool_args(function["arguments"])
+                            logging.debug("Cleaned args: %s", cleaned_args)
+
+                            # Stop early rather than spending the remaining iterations on a repeating call
+                            if loop_detector.record(tool_name, cleaned_args):
+                                looping_tool = tool_name
+                                break
+
+                            # Execute tool call via MCP while the rest of the response streams in
+                            # (identical reads are made once)
+                            tool_names.append(tool_name)
+                            report.tools_called.append(tool_name)
+                            tool_tasks.append(asyncio.create_task(
+                                self._tool_calls.call_tool(self.session, tool_name, cleaned_args)
+                            ))
+
+                            # Add note about tool call to the response
+                            yield f"{separator}[Calling tool: {tool_name}]"
+                            in_text = False
+                            separator = "\n\n"
+
+                        if looping_tool:
+                            break
+
+                if looping_tool:
+                    for task in tool_tasks:
+                        task.cancel()
+                    logging.warning(f"Tool call loop detected: {looping_tool}")
+                    report.complete = False
+                    yield f"{separator}[Loop detected: {looping_tool} keeps being called with the same arguments; aborting]"
+                    return
+
+                # A failed call is reported to the model so it can recover
+                mcp_results = await asyncio.gather(*tool_tasks, return_exceptions=True)
+            except BaseException:
+                for task in tool_tasks:
+                    task.cancel()
+                raise
+
+            message = {"role": "assistant", "content": content}
+            if tool_calls:
+                message["tool_calls"] = tool_calls
+            logging.debug("Agent response: %s", message)
 
             # Check if there are tool calls to process
-            if not message.get("tool_calls"):
+            if not tool_calls:
                 # No more tool calls - agent is done
                 logging.info("No tool calls found. Agent loop complete.")
                 break
@@ -217,40 +314,71 @@ Examples:
             # Add the assistant's message with tool calls to history
             messages.append(message)
 
-            # Process each tool call
-            for tool_call in message["tool_calls"]:
-                function = tool_call["function"]
-                tool_name = function["name"]
-                tool_args = function["arguments"]
-
-                # Clean tool arguments to remove empty values that cause API errors
-                cleaned_args = self._clean_tool_args(tool_args)
-                logging.info(f"Calling tool: {tool_name}")
-                logging.info(f"Original args: {tool_args}")
-                logging.info(f"Cleaned args: {cleaned_args}")
+            for tool_name, mcp_result in zip(tool_names, mcp_results):
+                if isinstance(mcp_result, BaseException):
+                    logging.warning(f"Tool {tool_name} failed: {mcp_result}")
+                    result_content = f"Error: {mcp_result}"
+                else:
+                    logging.debug("Tool result: %s", mcp_result.content)
+                    result_content = truncate_tool_result(str(mcp_result.content))
 
-                # Execute tool call via MCP
-                mcp_result = await self.session.call_tool(tool_name, cleaned_args)
-
-                # Add note about tool call to final text
-                final_text.append(f"[Calling tool: {tool_name}]")
-                logging.info(f"Tool result: {mcp_result.content}")
                 # Add tool result to messages for next iteration
                 messages.append({
                     "role": "tool",
-                    "content": str(mcp_result.content)
+                    "content": result_content
                 })
 
             # Continue loop - agent will process tool results and decide next action
 
         if iteration >= max_iterations:
             logging.warning(f"Agent loop reached max iterations ({max_iterations})")
-            final_text.append(f"[Warning: Reached maximum iteration limit of {max_iterations}]")
+            report.complete = False
+            yield f"{separator}[Warning: Reached maximum iteration limit of {max_iterations}]"
+
+    async def _chat(self, payload: dict, cache_key: str):
+        """Stream an /api/chat response as (text, tool_calls) message deltas.
 
-        return "\n\n".join(final_text)
+        The response to an identical earlier request is replayed from the LLM cache.
+        """
+        if cache_key in llm_cache:
+            logging.info("LLM cache hit")
+            yield llm_cache[cache_key]
+            return
+
+        content = ""
+        tool_calls = []
+        async with self.client.stream(
+            "POST", "/api/chat",
+            content=orjson.dumps(payload),
+            headers={"Content-Type": "application/json"}
+        ) as response:
+            if response.status_code >= 400:
+                # The body isn't read yet on a streamed response; load it for the error message
+                await response.aread()
+                response.raise_for_status()
+
+            async for line in response.aiter_lines():
+                if not line:
+                    continue
+                chunk = orjson.loads(line)
+                if "error" in chunk:
+                    raise RuntimeError(f"Ollama error: {chunk['error']}")
+                chunk_message = chunk.get("message", {})
+
+                token = chunk_message.get("content") or ""
+                new_tool_calls = chunk_message.get("tool_calls") or []
+                if token or new_tool_calls:
+                    yield token, new_tool_calls
+                    content += token
+                    tool_calls.extend(new_tool_calls)
+
+                if chunk.get("done"):
+                    break
+
+        if content or tool_calls:
+            llm_cache[cache_key] = (content, tool_calls)
 
     async def cleanup(self):
-        """Cleanup resources"""
-        await self.client.aclose()
+        """Cleanup resources (the shared HTTP client is closed by close_ollama_http_clients)"""
         await self.exit_stack.aclose()
 
@@ -3,17 +3,33 @@ MCP Client with OpenAI support (cheaper alternative to Anthropic)
 """
 
 import asyncio
-import json
 from typing import Optional
 from contextlib import AsyncExitStack
 
-from mcp import ClientSession, StdioServerParameters
-from mcp.client.stdio import stdio_client
+from mcp import ClientSession
+from mcp.types import TextContent
 
+from .tool_utils import LoopDetector, QueryReport, ToolCallCache
+from .transport import open_transport
+
+import orjson
 from openai import AsyncOpenAI
 from dotenv import load_dotenv
 
-load_dotenv()
+
+def _serialize_content(content) -> str:
+    """Serialize MCP tool result content (a list of content blocks) for a tool message.
+
+    Text-only results (the usual case) are passed on as their text, without a
+    JSON encoding pass; anything else is serialized to JSON.
+    """
+    if isinstance(content, str):
+        return content
+    if isinstance(content, (bytes, bytearray)):
+        return content.decode()
+    if all(isinstance(block, TextContent) for block in content):
+        return "\n".join(block.text for block in content)
+    return orjson.dumps(content, default=lambda block: block.model_dump(mode="json")).decode()
 
 
 class MCPClientOpenAI:
@@ -21,48 +37,84 @@ class MCPClientOpenAI:
         self.session: Optional[ClientSession] = None
         self.exit_stack = AsyncExitStack()
         self.openai = AsyncOpenAI()  # Reads OPENAI_API_KEY from env
+        self._tool_calls = ToolCallCache()
 
-    async def connect_to_server(self, server_script_path: str = None, env: dict = None, command: str = None, args: list = None):
-        """Connect to an MCP server"""
-        if command and args:
-            server_params = StdioServerParameters(
-                command=command,
-                args=args,
-                env=env
-            )
-        elif server_script_path:
-            is_python = server_script_path.endswith('.py')
-            is_js = server_script_path.endswith('.js')
-            if not (is_python or is_js):
-                raise ValueError("Server script must be a .py or .js file")
-
-            cmd = "python" if is_python else "node"
-            server_params = StdioServerParameters(
-                command=cmd,
-                args=[server_script_path],
-                env=env
-            )
-        else:
-            raise ValueError("Must provide either (command + args) or server_script_path")
+        # MCP tools in OpenAI format, built once per session
+        self._available_tools: Optional[list] = None
 
-        stdio_transport = await self.exit_stack.enter_async_context(stdio_client(server_params))
-        self.stdio, self.write = stdio_transport
-        self.session = await self.exit_stack.enter_async_context(ClientSession(self.stdio, self.write))
+    async def __aenter__(self):
+        await self.exit_stack.__aenter__()
+        return self
 
-        await self.session.initialize()
+    async def __aexit__(self, *exc_info):
+        """Close the MCP connections in the task that opened them."""
+        return await self.exit_stack.__aexit__(*exc_info)
 
+    async def connect_to_server(self, server_script_path: str = None, env: dict = None, command: str = None, args: list = None,
+                                transport: str = "stdio", url: str = None, headers: dict = None):
+        """Connect to an MCP server"""
+        # Connect on a local exit stack so a failed connect shuts the server down
+        # straight away; on success ownership moves to the client's exit stack
+        async with AsyncExitStack() as connection_stack:
+            stdio, write = await connection_stack.enter_async_context(open_transport(
+                transport, server_script_path, env, command, args, url=url, headers=headers
+            ))
+            session = await connection_stack.enter_async_context(ClientSession(stdio, write))
+
+            await session.initialize()
+
+            response = await session.list_tools()
+            self.exit_stack.push_async_callback(connection_stack.pop_all().aclose)
+
+        self.stdio, self.write, self.session = stdio, write, session
+        self._set_tools(response.tools)
+        print("\nConnected to server with tools:", [tool.name for tool in response.tools])
+
+    def _set_tools(self, mcp_tools):
+        """Convert the MCP tool list to OpenAI format."""
+        self._available_tools = [{
+            "type": "function",
+            "function": {
+                "name": tool.name,
+                "description": tool.description or "No description",
+                "parameters": tool.inputSchema
+            }
+        } for tool in mcp_tools]
+
+    async def refresh_tools(self):
+        """Fetch the tool list again (for the rare case the server's tools change)."""
         response = await self.session.list_tools()
-        tools = response.tools
-        print("\nConnected to server with tools:", [tool.name for tool in tools])
+        self._set_tools(response.tools)
 
-    async def process_query(self, query: str, model: str = "gpt-4o") -> str:
-        """Process a query using OpenAI and available tools
+    async def process_query(self, query: str, model: str = "gpt-4o", max_iterations: int = 10,
+                            report: Optional[QueryReport] = None) -> str:
+        """Process a query using OpenAI and available tools with agent loop logic
 
         Args:
             query: The user's question
             model: OpenAI model to use (default: gpt-4o for best tool calling)
                   Options: gpt-4o, gpt-4o-mini, gpt-4-turbo
+            max_iterations: Maximum number of agent loop iterations (default: 10)
+            report: Optional QueryReport to fill in with the tools called
         """
+        return "".join([chunk async for chunk in self.stream_query(query, model, max_iterations, report)])
+
+    async def stream_query(self, query: str, model: str = "gpt-4o", max_iterations: int = 10,
+                           report: Optional[QueryReport] = None):
+        """Process a query like process_query, yielding the response as it is generated
+
+        Args:
+            query: The user's question
+            model: OpenAI model to use (default: gpt-4o for best tool calling)
+            max_iterations: Maximum number of agent loop iterations (default: 10)
+            report: Optional QueryReport to fill in with the tools called
+
+        Yields:
+            Response text chunks (model tokens, tool call notes and separators)
+        """
+        if report is None:
+            report = QueryReport()
+
         messages = [
             {
                 "role": "user",
@@ -70,136 +122,179 @@ class MCPClientOpenAI:
             }
         ]
 
-        # Get MCP tools and convert to OpenAI format
-        mcp_response = await self.session.list_tools()
-        available_tools = [{
-            "type": "function",
-            "function": {
-                "name": tool.name,
-                "description": tool.description or "No description",
-                "parameters": tool.inputSchema
-            }
-        } for tool in mcp_response.tools]
+        # MCP tools in OpenAI format (built once per session)
+        if self._available_tools is None:
+            await self.refresh_tools()
+        available_tools = self._available_tools
 
         print(f"\n[DEBUG] Using model: {model}")
         print(f"[DEBUG] Available tools: {[t['function']['name'] for t in available_tools]}")
 
-        # Initial OpenAI API call
-        response = await self.openai.chat.completions.create(
-            model=model,
-            max_tokens=2000,
-            messages=messages,
-            tools=available_tools,
-            tool_choice="auto"  # Let model decide when to use tools
-        )
+        # Separator emitted before the next response segment (text or tool call note)
+        separator = ""
+
+        loop_detector = LoopDetector()
 
-        # Process response and handle tool calls
-        final_text = []
-        message = response.choices[0].message
+        # Agent loop: continue until no more tool calls or max iterations reached
+        for iteration in range(1, max_iterations + 1):
+            print(f"[DEBUG] Agent loop iteration {iteration}/{max_iterations}")
 
-        print(f"[DEBUG] Response finish_reason: {response.choices[0].finish_reason}")
-        print(f"[DEBUG] Tool calls: {message.tool_calls}")
+            request = {"model": model, "max_tokens": 2000, "messages": messages}
+            if iteration < max_iterations:
+                request.update(tools=available_tools, tool_choice="auto")  # Let model decide when to use tools
+            # On the last iteration tool calls couldn't be run any more, so the tool
+            # schemas aren't sent and the model answers with what it has
 
-        if message.content:
-            final_text.append(message.content)
+            # Call OpenAI API, streaming tokens as they are generated
+            content = ""
+            tool_calls = {}
+            async for token in self._stream_completion(tool_calls, **request):
+                yield token if content else separator + token
+                content += token
+            if content:
+                separator = "\n"
+
+            # Tool calls in the order the model made them
+            tool_calls = [tool_calls[index] for index in sorted(tool_calls)]
+            print(f"[DEBUG] Tool calls: {tool_calls}")
+
+            # Check if there are tool calls to process
+            if not tool_calls:
+                # No more tool calls - agent is done
+                return
 
-        # Handle tool calls
-        if message.tool_calls:
             # Add assistant message with tool calls
             messages.append({
                 "role": "assistant",
-                "content": message.content,
+                "content": content or None,
                 "tool_calls": [
                     {
-                        "id": tc.id,
+                        "id": tc["id"],
                         "type": "function",
                         "function": {
-                            "name": tc.function.name,
-                            "arguments": tc.function.arguments
+                            "name": tc["name"],
+                            "arguments": tc["arguments"]
                         }
-                    } for tc in message.tool_calls
+                    } for tc in tool_calls
                 ]
             })
 
-            for tool_call in message.tool_calls:
-                tool_name = tool_call.function.name
-
-                # Parse JSON arguments safely
+            # Parse JSON arguments up front, so a malformed call fails before any tool runs.
+            # Every tool call needs a tool message, so a parse error is reported as its result
+            calls = []
+            for tool_call in tool_calls:
                 try:
-                    tool_args = json.loads(tool_call.function.arguments)
-                except json.JSONDecodeError as e:
+                    tool_args = orjson.loads(tool_call["arguments"])
+                except orjson.JSONDecodeError as e:
                     print(f"[ERROR] Failed to parse tool arguments: {e}")
-                    print(f"[ERROR] Raw arguments: {tool_call.function.arguments}")
+                    print(f"[ERROR] Raw arguments: {tool_call['arguments']}")
+                    calls.append((tool_call, e))
                     continue
+                print(f"[DEBUG] Calling tool: {tool_call['name']} with args: {tool_args}")
+
+                # Stop early rather than spending the remaining iterations on a repeating call
+                if loop_detector.record(tool_call["name"], tool_args):
+                    print(f"[ERROR] Tool call loop detected: {tool_call['name']}")
+                    report.complete = False
+                    yield f"{separator}[Loop detected: {tool_call['name']} keeps being called with the same arguments; aborting]"
+                    return
+                report.tools_called.append(tool_call["name"])
+                calls.append((tool_call, tool_args))
+
+            # Execute the tool calls via MCP concurrently - they are independent within
+            # one response, so together they take max(latency) rather than sum
+            # (identical reads are made once)
+            results = await asyncio.gather(
+                *[
+                    self._tool_calls.call_tool(self.session, tool_call["name"], tool_args)
+                    for tool_call, tool_args in calls if not isinstance(tool_args, Exception)
+                ],
+                return_exceptions=True
+            )
+            results = iter(results)
 
-                print(f"[DEBUG] Calling tool: {tool_name} with args: {tool_args}")
-
-                # Execute tool call via MCP
-                try:
-                    result = await self.session.call_tool(tool_name, tool_args)
-                    final_text.append(f"[Calling {tool_name}]")
-
-                    # Add tool result to messages
-                    messages.append({
-                        "role": "tool",
-                        "tool_call_id": tool_call.id,
-                        "content": json.dumps(result.content) if not isinstance(result.content, str) else result.content
-                    })
-                except Exception as e:
-                    print(f"[ERROR] Tool call failed: {e}")
+            # Add tool results to messages in the order the model made the calls
+            for tool_call, tool_args in calls:
+                result = tool_args if isinstance(tool_args, Exception) else next(results)
+                if isinstance(result, BaseException):
+                    print(f"[ERROR] Tool call failed: {result}")
                     messages.append({
                         "role": "tool",
-                        "tool_call_id": tool_call.id,
-                        "content": f"Error: {str(e)}"
+                        "tool_call_id": tool_call["id"],
+                        "content": f"Error: {str(result)}"
                     })
+                    continue
 
-            # Get final response from OpenAI after tool execution
-            response = await self.openai.chat.completions.create(
-                model=model,
-                max_tokens=2000,
-                messages=messages,
-                tools=available_tools
-            )
+                yield f"{separator}[Calling {tool_call['name']}]"
+                separator = "\n"
+                messages.append({
+                    "role": "tool",
+                    "tool_call_id": tool_call["id"],
+                    "content": _serialize_content(result.content)
+                })
+
+            # Continue loop - agent will process tool results and decide next action
 
-            if response.choices[0].message.content:
-                final_text.append(response.choices[0].message.content)
+    async def _stream_completion(self, tool_calls: dict, **request):
+        """Stream a chat completion's text tokens.
 
-        return "\n".join(filter(None, final_text))
+        Tool calls arrive in fragments spread over several chunks; they are
+        assembled into tool_calls as {index: {"id", "name", "arguments"}}.
+        """
+        argument_fragments = {}
+        stream = await self.openai.chat.completions.create(stream=True, **request)
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            choice = chunk.choices[0]
+            if choice.delta.content:
+                yield choice.delta.content
+
+            for fragment in choice.delta.tool_calls or []:
+                tool_call = tool_calls.setdefault(fragment.index, {"id": "", "name": "", "arguments": ""})
+                if fragment.id:
+                    tool_call["id"] = fragment.id
+                if fragment.function:
+                    tool_call["name"] += fragment.function.name or ""
+                    if fragment.function.arguments:
+                        argument_fragments.setdefault(fragment.index, []).append(fragment.function.arguments)
+
+            if choice.finish_reason:
+                print(f"[DEBUG] Response finish_reason: {choice.finish_reason}")
+
+        # Arguments are joined once, rather than re-copied with every fragment
+        for index, fragments in argument_fragments.items():
+            tool_calls[index]["arguments"] = "".join(fragments)
 
 
 async def main():
     """Example usage"""
     import os
+    from .connections import connect_notion
 
-    client = MCPClientOpenAI()
-
-    notion_token = os.getenv("NOTION_INTEGRATION_TOKEN")
-    if not notion_token:
+    if not os.getenv("NOTION_INTEGRATION_TOKEN"):
         print("Set NOTION_INTEGRATION_TOKEN in .env first!")
         return
 
-    env_vars = os.environ.copy()
-    env_vars["NOTION_TOKEN"] = notion_token
-
-    try:
-        await client.connect_to_server(
-            command="npx",
-            args=["-y", "@notionhq/notion-mcp-server"],
-            env=env_vars
-        )
+    async with MCPClientOpenAI() as client:
+        await connect_notion(client)
 
         # Test with GPT-4o (best tool calling)
-        print("\n✅ Connected! Ask me anything:\n")
+        print("\n✅ Connected! Ask me anything (or 'quit' to exit):\n")
         print("Model: gpt-4o (best for tool calling)")
         print("For cheaper option, change to gpt-4o-mini\n")
 
-        query = input("You: ")
-        response = await client.process_query(query, model="gpt-4o")
-        print(f"\nAI: {response}\n")
+        # Interactive query loop - input is read in a thread so the MCP
+        # session's stdio reader keeps running while waiting for the user
+        while True:
+            query = await asyncio.to_thread(input, "You: ")
+            if not query or query.lower() in ['quit', 'exit', 'q']:
+                break
 
-    finally:
-        await client.exit_stack.aclose()
+            response = await client.process_query(query, model="gpt-4o")
+            print(f"\nAI: {response}\n")
 
 
 if __name__ == "__main__":
+    load_dotenv()  # load environment variables from .env
     asyncio.run(main())
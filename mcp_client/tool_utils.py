@@ -0,0 +1,180 @@
+"""
+Shared helpers for working with MCP tools across AI providers.
+"""
+
+import asyncio
+import hashlib
+import logging
+import re
+from collections import deque
+from dataclasses import dataclass, field
+from typing import List
+
+import orjson
+from cachetools import TTLCache
+
+# Tool names that change state (Notion pages/blocks, calendar events, ...).
+# Results of these must never be reused from a cache.
+_MUTATING_TOOL_RE = re.compile(
+    r"create|update|delete|patch|append|post-page|post-comment",
+    re.IGNORECASE
+)
+
+
+def is_mutating_tool(name: str) -> bool:
+    """Return True if the MCP tool name looks like it modifies data."""
+    return bool(_MUTATING_TOOL_RE.search(name))
+
+
+def canonical_json(obj) -> bytes:
+    """Serialize obj to JSON with sorted keys, so equal values always give the same bytes."""
+    return orjson.dumps(obj, default=str, option=orjson.OPT_SORT_KEYS | orjson.OPT_NON_STR_KEYS)
+
+
+def tool_cache_key(name: str, args: dict) -> str:
+    """Build a cache key for a tool call that doesn't depend on argument order."""
+    return f"{name}:{hashlib.blake2b(canonical_json(args), digest_size=16).hexdigest()}"
+
+
+# Tool results sent back to the model are cut to this size, roughly 4000 tokens
+# (~4 characters per token), so a large Notion payload can't blow up every later prompt
+MAX_TOOL_RESULT_CHARS = 16000
+
+# Maximum number of tool calls executed at the same time
+MAX_CONCURRENT_TOOL_CALLS = 8
+
+# Short-lived cache of read-only tool results (e.g. Notion search / get page)
+TOOL_CACHE_TTL = 60  # seconds
+TOOL_CACHE_SIZE = 256
+
+
+class ToolCallCache:
+    """Runs MCP tool calls, reusing the results of identical read-only calls.
+
+    Results of read-only tools are cached for TOOL_CACHE_TTL seconds, and an
+    identical call made while the first is still running waits for that one
+    instead of hitting the server again. Any mutating call clears the cache
+    and starts a new generation, since it may have changed what the cached
+    (or still running) reads would return: a read started before it is not
+    joined or cached afterwards.
+    """
+
+    def __init__(self, max_concurrent: int = MAX_CONCURRENT_TOOL_CALLS,
+                 maxsize: int = TOOL_CACHE_SIZE, ttl: float = TOOL_CACHE_TTL):
+        # Bounds concurrent requests written to the MCP server's stdio pipe
+        self._semaphore = asyncio.Semaphore(max_concurrent)
+        self._results = TTLCache(maxsize=maxsize, ttl=ttl)
+        self._in_flight = {}
+        self._generation = 0
+
+    def clear(self):
+        """Forget all cached results and in-flight reads."""
+        self._generation += 1
+        self._results.clear()
+        self._in_flight.clear()
+
+    async def call_tool(self, session, name: str, args: dict):
+        """Call an MCP tool through the session, or reuse an identical call's result."""
+        if is_mutating_tool(name):
+            self.clear()
+            return await self._call(session, name, args)
+
+        key = tool_cache_key(name, args)
+        if key in self._results:
+            logging.info(f"Tool cache hit: {name}")
+            return self._results[key]
+
+        task = self._in_flight.get(key)
+        if task is None:
+            task = asyncio.create_task(self._call_and_cache(session, name, args, key, self._generation))
+            self._in_flight[key] = task
+            task.add_done_callback(lambda done: self._forget_in_flight(key, done))
+        else:
+            logging.info(f"Joining identical in-flight tool call: {name}")
+
+        # Shielded, so one caller giving up doesn't cancel the call for the others
+        return await asyncio.shield(task)
+
+    async def _call_and_cache(self, session, name: str, args: dict, key: str, generation: int):
+        result = await self._call(session, name, args)
+        # Not cached if a mutating call ran meanwhile - the result may be stale
+        if not result.isError and generation == self._generation:
+            self._results[key] = result
+        return result
+
+    def _forget_in_flight(self, key: str, task: asyncio.Task):
+        # A mutation may already have replaced this task with a newer one for the same key
+        if self._in_flight.get(key) is task:
+            del self._in_flight[key]
+
+    async def _call(self, session, name: str, args: dict):
+        async with self._semaphore:
+            return await session.call_tool(name, args)
+
+
+def truncate_tool_result(text: str, max_chars: int = MAX_TOOL_RESULT_CHARS) -> str:
+    """Cut a tool result down to max_chars, marking that it was truncated."""
+    if len(text) <= max_chars:
+        return text
+    return text[:max_chars] + f"\n[...truncated {len(text) - max_chars} characters...]"
+
+
+class LoopDetector:
+    """Spots a model stuck calling the same tool with the same arguments.
+
+    The last `window` tool calls are kept (as cache keys); a call seen more
+    than `max_repeats` times among them counts as a loop.
+    """
+
+    def __init__(self, window: int = 5, max_repeats: int = 2):
+        self.max_repeats = max_repeats
+        self._recent = deque(maxlen=window)
+
+    def record(self, name: str, args: dict) -> bool:
+        """Record a tool call and return True if the agent is looping."""
+        key = tool_cache_key(name, args)
+        self._recent.append(key)
+        return self._recent.count(key) > self.max_repeats
+
+
+@dataclass
+class QueryReport:
+    """What a query did besides producing its response, filled in by the MCP clients.
+
+    Pass one to a client's process_query / stream_query as `report`.
+    """
+
+    tools_called: List[str] = field(default_factory=list)  # MCP tools run, in order
+    complete: bool = True  # False if the agent loop was cut short (loop, iteration limit, API error)
+
+    @property
+    def used_mutating_tool(self) -> bool:
+        """Whether any tool that changes data was called."""
+        return any(is_mutating_tool(name) for name in self.tools_called)
+
+
+def clean_tool_args(args: dict) -> dict:
+    """Remove empty strings, empty objects, and None values from tool arguments.
+
+    This is necessary because models (small Ollama models in particular) often
+    include optional parameters with empty values, which causes API validation
+    errors. Nested objects that are empty after cleaning are removed too.
+
+    The arguments are cleaned in place, without recursion, and returned.
+    """
+    # Collect every nested object (parents before children) ...
+    objects = [args]
+    i = 0
+    while i < len(objects):
+        objects.extend(value for value in objects[i].values() if isinstance(value, dict))
+        i += 1
+
+    # ... then clean children first, so an object emptied by cleaning is removed from its parent
+    for obj in reversed(objects):
+        empty_keys = [
+            key for key, value in obj.items()
+            if value is None or (isinstance(value, (str, dict, list)) and not value)
+        ]
+        for key in empty_keys:
+            del obj[key]
+    return args
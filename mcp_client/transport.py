@@ -0,0 +1,115 @@
+"""
+MCP Transports
+
+Opens the read/write streams for an MCP ClientSession over stdio (a local
+server subprocess) or HTTP (a server that is already running), so clients
+don't need to know which transport a server uses.
+"""
+
+from contextlib import asynccontextmanager
+from typing import Optional
+
+import httpx
+from mcp import StdioServerParameters
+from mcp.client.stdio import stdio_client
+
+TRANSPORTS = ("stdio", "sse", "streamable_http")
+
+# Connection pool for HTTP transports - httpx's defaults (20 keep-alive
+# connections, expired after 5s) run out when several users query at once
+HTTP_LIMITS = httpx.Limits(max_connections=500, max_keepalive_connections=100, keepalive_expiry=30.0)
+HTTP_TIMEOUT = httpx.Timeout(30.0, connect=5.0)
+
+
+def http_client_factory(
+    headers: Optional[dict] = None,
+    timeout: Optional[httpx.Timeout] = None,
+    auth: Optional[httpx.Auth] = None
+) -> httpx.AsyncClient:
+    """Create the httpx client for an HTTP transport, with tuned pool limits."""
+    return httpx.AsyncClient(
+        headers=headers,
+        timeout=timeout or HTTP_TIMEOUT,
+        auth=auth,
+        limits=HTTP_LIMITS,
+        follow_redirects=True
+    )
+
+
+def stdio_server_params(
+    server_script_path: str = None,
+    env: dict = None,
+    command: str = None,
+    args: list = None
+) -> StdioServerParameters:
+    """Build the parameters for launching a server subprocess (command + args, or a script path)."""
+    # New direct method: command + args
+    if command:
+        return StdioServerParameters(
+            command=command,
+            args=args or [],
+            env=env
+        )
+
+    # Legacy method: script path
+    if server_script_path:
+        is_python = server_script_path.endswith('.py')
+        is_js = server_script_path.endswith('.js')
+        if not (is_python or is_js):
+            raise ValueError("Server script must be a .py or .js file")
+
+        cmd = "python" if is_python else "node"
+        return StdioServerParameters(
+            command=cmd,
+            args=[server_script_path],
+            env=env
+        )
+
+    raise ValueError("Must provide either (command + args) or server_script_path")
+
+
+@asynccontextmanager
+async def open_transport(
+    transport: str = "stdio",
+    server_script_path: str = None,
+    env: dict = None,
+    command: str = None,
+    args: list = None,
+    url: Optional[str] = None,
+    headers: Optional[dict] = None
+):
+    """
+    Open an MCP transport, yielding its (read, write) streams.
+
+    Args:
+        transport: "stdio", "sse" or "streamable_http"
+        server_script_path, env, command, args: Server subprocess to launch (stdio only)
+        url: Server endpoint (HTTP transports only)
+        headers: Optional HTTP headers (HTTP transports only)
+
+    Raises:
+        ValueError: If the transport is unknown or its required arguments are missing
+    """
+    if transport not in TRANSPORTS:
+        raise ValueError(f"Unsupported transport: {transport}. Supported transports: {', '.join(TRANSPORTS)}")
+
+    if transport == "stdio":
+        server_params = stdio_server_params(server_script_path, env, command, args)
+        async with stdio_client(server_params) as (read, write):
+            yield read, write
+        return
+
+    if not url:
+        raise ValueError(f"The {transport} transport requires a server url")
+
+    # HTTP transports are imported on demand, like the provider clients
+    if transport == "sse":
+        from mcp.client.sse import sse_client
+        async with sse_client(url, headers=headers, httpx_client_factory=http_client_factory) as (read, write):
+            yield read, write
+    else:
+        from mcp.client.streamable_http import streamablehttp_client
+        async with streamablehttp_client(
+            url, headers=headers, httpx_client_factory=http_client_factory
+        ) as (read, write, _):
+            yield read, write
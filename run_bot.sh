@@ -25,6 +25,10 @@ parse_bot_args() {
                 BOT_ARGS="$BOT_ARGS $1 $2"
                 shift 2
                 ;;
+            --polling)
+                BOT_ARGS="$BOT_ARGS $1"
+                shift
+                ;;
             *)
                 echo "Unknown argument: $1"
                 exit 1
@@ -5,5 +5,6 @@ Provides modular Telegram bot functionality with AI integration.
 """
 
 from .bot import TelegramBot
+from .config import BotConfig
 
-__all__ = ["TelegramBot"]
+__all__ = ["TelegramBot", "BotConfig"]
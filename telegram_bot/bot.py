@@ -3,32 +3,34 @@ Main Telegram bot implementation.
 """
 
 import logging
+
 from telegram import Update
 from telegram.ext import Application, CommandHandler, MessageHandler, filters
 
+from .config import BotConfig
 from .handlers import BotHandlers
+from .user_manager import count_users
 
 logger = logging.getLogger(__name__)
 
+# All handlers react to plain messages only; add other update types here if a handler needs them
+ALLOWED_UPDATES = [Update.MESSAGE]
+
 
 class TelegramBot:
     """Main Telegram bot class."""
 
-    def __init__(self, token: str, mcp_client=None, provider_name="Unknown", model_name="Unknown"):
+    def __init__(self, config: BotConfig, mcp_client=None):
         """
         Initialize the Telegram bot.
 
         Args:
-            token: Telegram bot token
+            config: Bot configuration (token, provider, model, webhook settings)
             mcp_client: MCP client instance for AI functionality
-            provider_name: Name of the AI provider
-            model_name: Name of the AI model
         """
-        self.token = token
+        self.config = config
         self.mcp_client = mcp_client
-        self.provider_name = provider_name
-        self.model_name = model_name
-        self.handlers = BotHandlers(mcp_client, provider_name, model_name)
+        self.handlers = BotHandlers(mcp_client, config.provider, config.model)
         self.application = None
 
 
@@ -52,17 +54,28 @@ class TelegramBot:
     async def initialize(self) -> None:
         """Initialize the bot application."""
         logger.info("🤖 Initializing Telegram bot...")
-        logger.info(f"   Provider: {self.provider_name}")
-        logger.info(f"   Model: {self.model_name}")
-
-        # Create the Application
-        self.application = Application.builder().token(self.token).build()
+        logger.info(f"   Provider: {self.config.provider}")
+        logger.info(f"   Model: {self.config.model}")
+
+        # Open the user database (migrating legacy user files) at startup
+        logger.info(f"   Registered users: {await count_users()}")
+
+        # Create the Application - updates are handled concurrently so a slow
+        # AI query doesn't hold up other users' commands, and the bot's API
+        # requests (replies, broadcast fan-out) are multiplexed over HTTP/2
+        self.application = (
+            Application.builder()
+            .token(self.config.token)
+            .concurrent_updates(True)
+            .http_version("2")
+            .build()
+        )
 
         # Setup all handlers
         self.setup_handlers(self.application)
 
     async def run(self) -> None:
-        """Start the bot."""
+        """Start the bot (webhook mode if config.webhook_url is set, long polling otherwise)."""
         if not self.application:
             raise RuntimeError("Bot not initialized. Call initialize() first.")
 
@@ -70,9 +83,20 @@ class TelegramBot:
         async with self.application:
             await self.application.initialize()
             await self.application.start()
-            await self.application.updater.start_polling(allowed_updates=Update.ALL_TYPES)
 
-            logger.info("✅ Bot is running!")
+            if self.config.webhook_url:
+                # Telegram pushes updates as they arrive - no idle polling round-trips
+                await self.application.updater.start_webhook(
+                    listen="0.0.0.0",
+                    port=self.config.port,
+                    url_path=self.config.token,
+                    webhook_url=f"{self.config.webhook_url.rstrip('/')}/{self.config.token}",
+                    allowed_updates=ALLOWED_UPDATES
+                )
+                logger.info(f"✅ Bot is running! (webhook on port {self.config.port})")
+            else:
+                await self.application.updater.start_polling(allowed_updates=ALLOWED_UPDATES)
+                logger.info("✅ Bot is running! (polling)")
 
             # Keep the bot running
             import asyncio
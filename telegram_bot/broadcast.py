@@ -0,0 +1,71 @@
+"""
+Sending a message to every registered user under Telegram's rate limits.
+"""
+
+import asyncio
+import logging
+
+from aiolimiter import AsyncLimiter
+from telegram.error import RetryAfter
+
+from .user_manager import iter_user_id_batches
+
+logger = logging.getLogger(__name__)
+
+# Telegram allows ~30 messages/second across all chats
+BROADCAST_RATE_LIMIT = 30
+BROADCAST_MAX_RETRIES = 3
+
+
+async def send_with_retry(limiter: AsyncLimiter, chat_id, send):
+    """
+    Deliver a message under the rate limiter, waiting out Telegram flood-control errors.
+
+    Args:
+        limiter: Rate limiter shared by all outgoing sends
+        chat_id: Target chat ID
+        send: Coroutine function taking the chat ID that performs the API call
+    """
+    attempt = 0
+    while True:
+        async with limiter:
+            try:
+                return await send(int(chat_id))
+            except RetryAfter as e:
+                attempt += 1
+                if attempt > BROADCAST_MAX_RETRIES:
+                    raise
+                retry_after = e.retry_after
+        logger.warning(f"Rate limited sending to {chat_id}, retrying in {retry_after}s")
+        await asyncio.sleep(retry_after)
+
+
+async def send_to_all_users(limiter: AsyncLimiter, send, already_sent_chat_id=None):
+    """
+    Send a message to every registered user, a batch of users at a time.
+
+    Args:
+        limiter: Rate limiter shared by all outgoing sends
+        send: Coroutine function taking the chat ID that performs the API call
+        already_sent_chat_id: Chat that already has the message (skipped, but counted as sent)
+
+    Returns:
+        Tuple of (sent count, failed count)
+    """
+    sent_count = failed_count = 0
+    async for batch in iter_user_id_batches():
+        chat_ids = [chat_id for chat_id in batch if chat_id != already_sent_chat_id]
+        sent_count += len(batch) - len(chat_ids)
+
+        # Shared token bucket keeps concurrent sends under Telegram's global rate limit
+        results = await asyncio.gather(
+            *[send_with_retry(limiter, chat_id, send) for chat_id in chat_ids],
+            return_exceptions=True
+        )
+        for chat_id, result in zip(chat_ids, results):
+            if isinstance(result, Exception):
+                logger.error(f"Failed to send to {chat_id}: {result}")
+                failed_count += 1
+            else:
+                sent_count += 1
+    return sent_count, failed_count
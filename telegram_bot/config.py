@@ -0,0 +1,17 @@
+"""
+Telegram bot configuration.
+"""
+
+from dataclasses import dataclass
+from typing import Optional
+
+
+@dataclass(frozen=True)
+class BotConfig:
+    """Bot settings resolved once at startup from CLI arguments and environment."""
+
+    token: str
+    provider: str
+    model: str
+    webhook_url: Optional[str] = None  # None means long polling
+    port: int = 8443
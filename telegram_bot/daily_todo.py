@@ -2,9 +2,14 @@
 Daily todo reminder functionality.
 """
 
+import asyncio
 import logging
 from datetime import datetime
-from telegram_bot.user_manager import load_users
+
+from aiolimiter import AsyncLimiter
+
+from telegram_bot.broadcast import BROADCAST_RATE_LIMIT, send_to_all_users
+from telegram_bot.user_manager import count_users
 
 logger = logging.getLogger(__name__)
 
@@ -14,9 +19,12 @@ async def daily_todo_reminder(bot_application, mcp_client):
     Run daily at 8 AM to prompt users for todos.
 
     This function:
-    1. Loads all registered users
-    2. For each user, calls the AI to create a Notion toggle list for today
-    3. Sends the AI's response (asking for todos) to the user via Telegram
+    1. Calls the AI once to create a Notion toggle list for today
+    2. Sends the AI's response (asking for todos) to every registered user via Telegram
+
+    The prompt is the same for every user and works on the one connected Notion
+    workspace, so a single AI query serves everyone (one toggle list, one LLM
+    and tool round-trip per day instead of one per user).
 
     Args:
         bot_application: Telegram bot Application instance
@@ -31,44 +39,51 @@ async def daily_todo_reminder(bot_application, mcp_client):
 
     # Load registered users
     try:
-        users = load_users()
-        logger.info(f"📋 Sending reminders to {len(users)} user(s)")
+        user_count = await count_users()
+        logger.info(f"📋 Sending reminders to {user_count} user(s)")
     except Exception as e:
         logger.error(f"❌ Failed to load users: {e}")
         return
 
-    # For each user, send a personalized reminder
-    sent_count = 0
-    failed_count = 0
-
-    for chat_id, user_data in users.items():
-        try:
-            # Get today's date for the toggle list title
-            today = datetime.now().strftime("%Y-%m-%d")
-
-            # Create prompt for AI to create Notion toggle list and ask for todos
-            prompt = (
-                f'In my Notion workspace, find the "Daily Todo" page and create a new '
-                f'toggle list titled "{today}". Then ask me what todos I want to add for today.'
-            )
-
-            # Call AI to process the prompt
-            logger.info(f"💭 Processing reminder for user {chat_id}")
-            response = await mcp_client.process_query(prompt)
-
-            # Send AI response to user via Telegram
-            await bot_application.bot.send_message(
-                chat_id=int(chat_id),
-                text=response
-            )
-
-            sent_count += 1
-            logger.info(f"✅ Sent reminder to {chat_id}")
-
-        except Exception as e:
-            failed_count += 1
-            logger.error(f"❌ Failed to send reminder to {chat_id}: {e}")
-            continue
+    if not user_count:
+        return
+
+    # Get today's date for the toggle list title
+    today = datetime.now().strftime("%Y-%m-%d")
+
+    # Create prompt for AI to create Notion toggle list and ask for todos
+    prompt = (
+        f'In my Notion workspace, find the "Daily Todo" page and create a new '
+        f'toggle list titled "{today}". Then ask me what todos I want to add for today.'
+    )
+
+    # Call AI to process the prompt
+    try:
+        logger.info("💭 Processing daily reminder")
+        response = await mcp_client.process_query(prompt)
+    except Exception as e:
+        logger.error(f"❌ Failed to generate daily reminder: {e}")
+        return
+
+    # Send the reminder text once, then copy that message to everyone else (as /broadcast
+    # does), so each further request carries message IDs instead of the whole response
+    source = None
+    source_lock = asyncio.Lock()
+
+    async def send_reminder(chat_id: int):
+        nonlocal source
+        async with source_lock:
+            if source is None:
+                source = await bot_application.bot.send_message(chat_id=chat_id, text=response)
+                return source
+        return await bot_application.bot.copy_message(
+            chat_id=chat_id,
+            from_chat_id=source.chat_id,
+            message_id=source.message_id
+        )
+
+    # Send AI response to every user via Telegram, under Telegram's global rate limit
+    sent_count, failed_count = await send_to_all_users(AsyncLimiter(BROADCAST_RATE_LIMIT, 1), send_reminder)
 
     logger.info(
         f"🎉 Daily reminder complete! Sent: {sent_count}, Failed: {failed_count}"
@@ -2,14 +2,55 @@
 Telegram bot command handlers.
 """
 
+import asyncio
+import hashlib
 import logging
+from aiolimiter import AsyncLimiter
+from cachetools import TTLCache
 from telegram import Update
+from telegram.error import BadRequest, RetryAfter
 from telegram.ext import ContextTypes
 
-from .user_manager import save_user, load_users
+from mcp_client.tool_utils import QueryReport
+from .broadcast import BROADCAST_RATE_LIMIT, send_to_all_users
+from .user_manager import save_user
 
 logger = logging.getLogger(__name__)
 
+# Identical AI queries within this window are answered from memory
+AI_CACHE_TTL = 180
+AI_CACHE_SIZE = 1024
+
+# Minimum seconds between edits of a streaming response (Telegram rate-limits message edits)
+STREAM_EDIT_INTERVAL = 1.0
+
+# Static reply texts, formatted once instead of rebuilt on every command
+_WELCOME_TEMPLATE = (
+    "Hello {name}! 👋\n\n"
+    "I'm an AI-powered bot with access to your Notion workspace.\n"
+    "Provider: {provider}\n"
+    "Model: {model}\n\n"
+    "Commands:\n"
+    "  /ai <question> - Ask me anything!\n"
+    "  /help - Show all commands\n\n"
+    "Your chat ID: {chat_id}"
+)
+
+_HELP_TEMPLATE = (
+    "🤖 Available commands:\n\n"
+    "/start - Start the bot\n"
+    "/help - Show this help message\n"
+    "/ai <query> - Ask AI with Notion access\n"
+    "/mychatid - Get your chat ID\n"
+    "/broadcast <message> - Send to all users\n\n"
+    "AI Provider: {provider}\n"
+    "Model: {model}\n\n"
+    "Examples:\n"
+    "• /ai What's in my Notion workspace?\n"
+    "• /ai Search for pages about project X\n"
+    "• /ai Summarize my recent notes"
+)
+
 
 class BotHandlers:
     """Handles all Telegram bot commands and messages."""
@@ -26,40 +67,28 @@ class BotHandlers:
         self.mcp_client = mcp_client
         self.provider_name = provider_name
         self.model_name = model_name
+        self._ai_cache = TTLCache(maxsize=AI_CACHE_SIZE, ttl=AI_CACHE_TTL)
+        self._ai_in_flight = {}
+        self._send_limiter = AsyncLimiter(BROADCAST_RATE_LIMIT, 1)
+        self._help_text = _HELP_TEMPLATE.format(provider=provider_name, model=model_name)
 
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Send a welcome message when the /start command is issued."""
         user = update.effective_user
-        save_user(user.id, user.username, user.first_name)
+        await save_user(user.id, user.username, user.first_name)
 
         await update.message.reply_text(
-            f"Hello {user.first_name}! 👋\n\n"
-            f"I'm an AI-powered bot with access to your Notion workspace.\n"
-            f"Provider: {self.provider_name}\n"
-            f"Model: {self.model_name}\n\n"
-            f"Commands:\n"
-            f"  /ai <question> - Ask me anything!\n"
-            f"  /help - Show all commands\n\n"
-            f"Your chat ID: {user.id}"
+            _WELCOME_TEMPLATE.format(
+                name=user.first_name,
+                provider=self.provider_name,
+                model=self.model_name,
+                chat_id=user.id
+            )
         )
 
     async def help_command(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Send a help message when the /help command is issued."""
-        help_text = (
-            "🤖 Available commands:\n\n"
-            "/start - Start the bot\n"
-            "/help - Show this help message\n"
-            "/ai <query> - Ask AI with Notion access\n"
-            "/mychatid - Get your chat ID\n"
-            "/broadcast <message> - Send to all users\n\n"
-            f"AI Provider: {self.provider_name}\n"
-            f"Model: {self.model_name}\n\n"
-            "Examples:\n"
-            "• /ai What's in my Notion workspace?\n"
-            "• /ai Search for pages about project X\n"
-            "• /ai Summarize my recent notes"
-        )
-        await update.message.reply_text(help_text)
+        await update.message.reply_text(self._help_text)
 
     async def get_chat_id(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Send the user's chat ID."""
@@ -76,18 +105,22 @@ class BotHandlers:
             return
 
         message = " ".join(context.args)
-        users = load_users()
 
-        sent_count = 0
-        failed_count = 0
+        # Send the message once (to the requesting chat), then copy that message to
+        # everyone else so Telegram reuses it instead of re-validating the text per user
+        source = await update.message.reply_text(message)
 
-        for chat_id in users.keys():
-            try:
-                await context.bot.send_message(chat_id=int(chat_id), text=message)
-                sent_count += 1
-            except Exception as e:
-                logger.error(f"Failed to send to {chat_id}: {e}")
-                failed_count += 1
+        async def copy_to(chat_id: int):
+            return await context.bot.copy_message(
+                chat_id=chat_id,
+                from_chat_id=source.chat_id,
+                message_id=source.message_id
+            )
+
+        # The requesting chat already received the source message
+        sent_count, failed_count = await send_to_all_users(
+            self._send_limiter, copy_to, already_sent_chat_id=source.chat_id
+        )
 
         await update.message.reply_text(
             f"Broadcast complete!\n"
@@ -106,7 +139,15 @@ class BotHandlers:
             return
 
         query = " ".join(context.args)
+        await self._answer_query(update, query)
+
+    async def echo(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
+        """Process user message with AI (conversational mode)."""
+        # Treat any non-command message as an AI query
+        await self._answer_query(update, update.message.text)
 
+    async def _answer_query(self, update: Update, query: str) -> None:
+        """Answer a user's query with the AI and reply in the chat."""
         # Check if MCP is initialized
         if not self.mcp_client or not self.mcp_client.session:
             await update.message.reply_text(
@@ -123,51 +164,111 @@ class BotHandlers:
         try:
             # Process query through MCP client
             logger.info(f"Processing AI query with {self.model_name}: {query}")
-            response = await self.mcp_client.process_query(query)
+            response = await self._process_query(query, thinking_msg)
 
             # Update message with response
-            await thinking_msg.edit_text(response)
+            await self._edit_message(thinking_msg, response)
 
         except Exception as e:
-
-            logger.error(f"Error processing AI query: {e.with_traceback()}")
+            logger.error(f"Error processing AI query: {e}", exc_info=True)
             await thinking_msg.edit_text(
                 f"❌ Error processing query: {str(e)}\n\n"
                 f"Please try again or check the logs."
             )
 
-    async def echo(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
-        """Process user message with AI (conversational mode)."""
-        # Treat any non-command message as an AI query
-        query = update.message.text
+    async def _process_query(self, query: str, thinking_msg=None) -> str:
+        """
+        Run a query through the MCP client, reusing recent answers to identical queries.
 
-        # Check if MCP is initialized
-        if not self.mcp_client or not self.mcp_client.session:
-            await update.message.reply_text(
-                "⚠️ AI features not available. MCP client not connected.\n"
-                "Check server logs for details."
-            )
-            return
+        Args:
+            query: The user's question
+            thinking_msg: Optional message to update with partial output while streaming
 
-        # Send "thinking" message
-        thinking_msg = await update.message.reply_text(
-            f"🤔 Thinking... (using {self.provider_name})"
-        )
+        Returns:
+            The complete AI response
+        """
+        key = hashlib.sha1(" ".join(query.lower().split()).encode()).hexdigest()
+        if key in self._ai_cache:
+            logger.info("Answering AI query from cache")
+            return self._ai_cache[key]
+
+        async def run():
+            report = QueryReport()
+            response = await self._run_query(query, report, thinking_msg)
+            # Cached before the task finishes, so no new identical query slips in between
+            if self._is_cacheable(response, report):
+                self._ai_cache[key] = response
+            return response
+
+        # Coalesce concurrent identical queries into a single LLM call
+        task = self._ai_in_flight.get(key)
+        if task is None:
+            task = asyncio.create_task(run())
+            self._ai_in_flight[key] = task
+            task.add_done_callback(lambda _: self._ai_in_flight.pop(key, None))
+        else:
+            logger.info("Joining identical in-flight AI query")
+
+        # Shielded, so one caller giving up doesn't cancel the query for the others
+        return await asyncio.shield(task)
+
+    async def _run_query(self, query: str, report: QueryReport, thinking_msg=None) -> str:
+        """Query the MCP client, streaming partial output into thinking_msg when supported."""
+        if thinking_msg is None or not hasattr(self.mcp_client, "stream_query"):
+            return await self.mcp_client.process_query(query, report=report)
+
+        parts = []
+        done = asyncio.Event()
 
+        async def show_progress():
+            # Edits run in their own task, so a slow edit doesn't hold up reading the
+            # stream, and text that arrived before a pause (e.g. a tool call) still shows
+            shown = ""
+            delay = STREAM_EDIT_INTERVAL
+            while True:
+                try:
+                    await asyncio.wait_for(done.wait(), delay)
+                    return
+                except asyncio.TimeoutError:
+                    pass
+
+                delay = STREAM_EDIT_INTERVAL
+                text = "".join(parts)
+                if not text.strip() or text == shown:
+                    continue
+                try:
+                    await self._edit_message(thinking_msg, text)
+                    shown = text
+                except RetryAfter as e:
+                    # Hit Telegram's edit limit - skip updates until it allows more
+                    delay = e.retry_after
+                except Exception as e:
+                    logger.warning(f"Failed to update streaming response: {e}")
+
+        progress = asyncio.create_task(show_progress())
         try:
-            # Process query through MCP client
-            logger.info(f"Processing AI query with {self.model_name}: {query}")
-            response = await self.mcp_client.process_query(query)
+            async for chunk in self.mcp_client.stream_query(query, report=report):
+                parts.append(chunk)
+        finally:
+            done.set()
+            await progress
+        return "".join(parts)
 
-            # Update message with response
-            await thinking_msg.edit_text(response)
+    @staticmethod
+    async def _edit_message(message, text: str) -> None:
+        """Edit a message, ignoring Telegram's error for unchanged text."""
+        try:
+            await message.edit_text(text)
+        except BadRequest as e:
+            if "not modified" not in str(e).lower():
+                raise
 
-        except Exception as e:
-            logger.error(f"Error processing AI query: {e}")
-            await thinking_msg.edit_text(
-                f"❌ Error processing query: {str(e)}\n\n"
-                f"Please try again or check the logs."
-            )
+    @staticmethod
+    def _is_cacheable(response: str, report: QueryReport) -> bool:
+        """Only cache complete, successful answers that did not modify any data."""
+        if not response or response.startswith("Error:") or not report.complete:
+            return False
+        return not report.used_mutating_tool
 
     async def error_handler(self, update: Update, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Log errors caused by updates."""
@@ -1,31 +1,150 @@
 """
 User management utilities for the Telegram bot.
+
+Registered users are stored in a SQLite database, so registering a user
+is a single upsert no matter how many users exist. Database access runs
+in a worker thread so it never blocks the event loop.
 """
 
-import os
-import json
+import asyncio
 import logging
+import os
+import sqlite3
+import threading
+
+import orjson
 
 logger = logging.getLogger(__name__)
 
+USERS_DB_FILE = "users.db"
+
+# Number of user IDs read from the database at a time when iterating over all users
+USER_ID_BATCH_SIZE = 1000
+
+# Older storage formats, migrated into the database on first use
 USERS_FILE = "users.json"
+USERS_LOG_FILE = "users.jsonl"
+
+_conn = None
+_conn_lock = threading.Lock()  # A sqlite3 connection must not be used by two threads at once
 
+# Details of users already known to be stored, {chat_id: (username, first_name)},
+# so a repeated /start doesn't touch the database
+_known_users = {}
+
+
+def _read_legacy_users():
+    """Read users from the legacy JSON snapshot and JSONL log, if present."""
+    users = {}
 
-def load_users():
-    """Load registered users from file."""
     if os.path.exists(USERS_FILE):
-        with open(USERS_FILE, 'r') as f:
-            return json.load(f)
-    return {}
-
-
-def save_user(chat_id, username, first_name):
-    """Save user chat ID to file."""
-    users = load_users()
-    users[str(chat_id)] = {
-        "username": username,
-        "first_name": first_name
-    }
-    with open(USERS_FILE, 'w') as f:
-        json.dump(users, f, indent=2)
-    logger.info(f"Saved user {chat_id} ({first_name})")
+        with open(USERS_FILE, 'rb') as f:
+            users.update(orjson.loads(f.read()))
+
+    if os.path.exists(USERS_LOG_FILE):
+        with open(USERS_LOG_FILE, 'rb') as f:
+            for line in f:
+                if line.strip():
+                    # Later entries override earlier ones for the same chat ID
+                    users.update(orjson.loads(line))
+
+    return users
+
+
+def _get_connection():
+    """Open the users database on first use, creating the schema and migrating legacy files."""
+    global _conn
+    if _conn is None:
+        conn = sqlite3.connect(USERS_DB_FILE, check_same_thread=False)
+        # WAL lets readers (e.g. another bot process) run alongside a write, and
+        # NORMAL sync is crash-safe in WAL mode without an fsync per commit
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute("PRAGMA synchronous=NORMAL")
+        conn.execute(
+            "CREATE TABLE IF NOT EXISTS users("
+            "chat_id INTEGER PRIMARY KEY, username TEXT, first_name TEXT)"
+        )
+
+        legacy_users = _read_legacy_users()
+        if legacy_users:
+            logger.info(f"Migrating {len(legacy_users)} user(s) to {USERS_DB_FILE}")
+            conn.executemany(
+                "INSERT OR REPLACE INTO users VALUES (?, ?, ?)",
+                [
+                    (int(chat_id), user_data.get("username"), user_data.get("first_name"))
+                    for chat_id, user_data in legacy_users.items()
+                ]
+            )
+        conn.commit()
+
+        for path in (USERS_FILE, USERS_LOG_FILE):
+            if os.path.exists(path):
+                os.replace(path, path + ".bak")
+
+        _conn = conn
+    return _conn
+
+
+async def _fetch_all(sql: str, params: tuple = ()):
+    """Run a read query in a worker thread and return all rows."""
+    def run():
+        with _conn_lock:
+            return _get_connection().execute(sql, params).fetchall()
+    return await asyncio.to_thread(run)
+
+
+async def _execute(sql: str, params: tuple = ()) -> int:
+    """Run a write statement in a worker thread and return the number of changed rows."""
+    def run():
+        with _conn_lock:
+            conn = _get_connection()
+            cursor = conn.execute(sql, params)
+            conn.commit()
+            return cursor.rowcount
+    return await asyncio.to_thread(run)
+
+
+async def iter_user_id_batches(batch_size: int = USER_ID_BATCH_SIZE):
+    """Yield the chat IDs of all registered users in lists of up to batch_size.
+
+    Only one batch is held in memory at a time; batches are read by chat ID
+    order, so users registered meanwhile don't shift later batches.
+    """
+    last_id = None
+    while True:
+        if last_id is None:
+            rows = await _fetch_all("SELECT chat_id FROM users ORDER BY chat_id LIMIT ?", (batch_size,))
+        else:
+            rows = await _fetch_all(
+                "SELECT chat_id FROM users WHERE chat_id > ? ORDER BY chat_id LIMIT ?", (last_id, batch_size)
+            )
+        if not rows:
+            return
+        yield [chat_id for (chat_id,) in rows]
+        if len(rows) < batch_size:
+            return
+        last_id = rows[-1][0]
+
+
+async def count_users() -> int:
+    """Get the number of registered users."""
+    rows = await _fetch_all("SELECT COUNT(*) FROM users")
+    return rows[0][0]
+
+
+async def save_user(chat_id, username, first_name):
+    """Save or update a user (no write happens if their details are unchanged)."""
+    chat_id = int(chat_id)
+    if _known_users.get(chat_id) == (username, first_name):
+        return
+
+    changed = await _execute(
+        "INSERT INTO users VALUES (?, ?, ?) "
+        "ON CONFLICT(chat_id) DO UPDATE SET "
+        "username = excluded.username, first_name = excluded.first_name "
+        "WHERE username IS NOT excluded.username OR first_name IS NOT excluded.first_name",
+        (chat_id, username, first_name)
+    )
+    _known_users[chat_id] = (username, first_name)
+    if changed:
+        logger.info(f"Saved user {chat_id} ({first_name})")